@@ -1,32 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 from octoprint import plugin
-from datetime import datetime, timedelta
-import multiprocessing, grp, pwd, os
-from rpi_ws281x import *
+from octoprint.printer import PrinterCallback
+import multiprocessing, threading, base64, os, signal
 from .utils import *
 from .basic_effects import *
+from .renderer import run_renderer
+from .timing import monotonic
+from .output import OUTPUT_BACKENDS, STRIP_TYPES
+from .heating import HeatingMonitor
+from .wizard import WizardChecks
+from .commands import CommandRunner
+from .framebuffer import FrameBuffer
+from .supervisor import RestartBackoff, CHECK_INTERVAL, HEARTBEAT_TIMEOUT, STARTUP_TIMEOUT
+from .custom_effects import compile_effects
+from .profiles import EFFECT_STATES, build_profiles, build_options, build_segments, build_renderer_config
 
 
 STRIP_SETTINGS = ['led_count', 'led_pin', 'led_freq_hz', 'led_dma', 'led_invert', 'led_brightness', 'led_channel', 'strip_type']
-STRIP_TYPES = {
-    'SK6812_STRIP_RGBW': SK6812_STRIP_RGBW,
-    'SK6812_STRIP_RBGW': SK6812_STRIP_RBGW,
-    'SK6812_STRIP_GRBW': SK6812_STRIP_GRBW,
-    'SK6812_STRIP_GBRW': SK6812_STRIP_GBRW,
-    'SK6812_STRIP_BRGW': SK6812_STRIP_BRGW,
-    'SK6812_STRIP_BGRW': SK6812_STRIP_BGRW,
-    'SK6812_SHIFT_WMASK':SK6812_SHIFT_WMASK,
-    'WS2811_STRIP_RGB': WS2811_STRIP_RGB,
-    'WS2811_STRIP_RBG': WS2811_STRIP_RBG,
-    'WS2811_STRIP_GRB': WS2811_STRIP_GRB,
-    'WS2811_STRIP_GBR': WS2811_STRIP_GBR,
-    'WS2811_STRIP_BRG': WS2811_STRIP_BRG,
-    'WS2811_STRIP_BGR': WS2811_STRIP_BGR,
-    'WS2812_STRIP': WS2812_STRIP,
-    'SK6812_STRIP': SK6812_STRIP,
-    'SK6812W_STRIP': SK6812W_STRIP,
-}
 IDLE_SETTINGS = ['idle_effect', 'idle_effect_color', 'idle_effect_delay', 'leds_reversed']
 DISCONNECTED_SETTINGS = ['disconnected_effect', 'disconnected_effect_color', 'disconnected_effect_delay']
 EFFECTS = {
@@ -40,6 +31,32 @@ EFFECTS = {
     'Knight Rider': knight_rider,
     'Plasma': plasma,
 }
+# Effects shown by the plugin itself rather than picked in the settings
+STATUS_EFFECTS = {
+    'Progress': progress_effect,
+    'Heating': progress_effect,
+}
+# The heating bar only replaces these effects
+HEATING_STATES = ['idle', 'progress', 'heating']
+# The preview stream stops unless it is renewed within PREVIEW_LEASE seconds
+PREVIEW_LEASE = 15
+PREVIEW_FPS = 10
+PREVIEW_MAX_PIXELS = 150
+# Seconds each setup command may take before it is killed
+COMMAND_TIMEOUTS = {
+    'adduser': 30,
+    'enable_spi': 30,
+    'increase_buffer': 30,
+    'set_frequency': 30,
+    'reboot': 60,
+}
+# Effect delays used to be divided by 100 or 50 instead of 1000 for these
+# effects. Settings version 2 made every delay milliseconds per step.
+LEGACY_DELAY_SCALE = {
+    'Color Wipe': 10,
+    'Knight Rider': 10,
+    'Plasma': 20,
+}
 
 class RGBStatusPlugin(
 	plugin.AssetPlugin,
@@ -50,23 +67,31 @@ class RGBStatusPlugin(
 	plugin.TemplatePlugin,
 	plugin.ShutdownPlugin,
 	plugin.SimpleApiPlugin,
-	plugin.WizardPlugin):
+	plugin.WizardPlugin,
+	PrinterCallback):
 
     api_errors = []
 
     def is_wizard_required(self):
+        if self._settings.get(['output_backend']) != 'neopixel':
+            # Nothing on the Pi itself needs setting up for network outputs
+            return False
         return any([not value for key, value in self.get_wizard_details().items()])
 
     def get_wizard_version(self):
         return 4
 
     def get_wizard_details(self):
-        return {
-            'adduser_done': self.adduser_done(),
-            'spi_enabled': self.spi_enabled(),
-            'buffer_increased': self.buffer_increased(),
-            'frequency_set': self.frequency_set(),
-        }
+        return self.wizard_checks().details()
+
+    def wizard_checks(self):
+        """The wizard checks for the configured boot folder. They parse the
+        boot files once and again only after the files changed."""
+        boot_path = self._settings.get(['boot_path'])
+        checks = getattr(self, '_wizard_checks', None)
+        if checks is None or checks.boot_path != boot_path:
+            checks = self._wizard_checks = WizardChecks(boot_path)
+        return checks
 
     def get_api_commands(self):
         return {
@@ -75,91 +100,144 @@ class RGBStatusPlugin(
             'increase_buffer': ['password'],
             'set_frequency': ['password'],
             'flipswitch':[],
+            'metrics':[],
+            'job': ['id'],
+            'preview': [],
+            'frame': ['pixels'],
             'reboot':[]
         }
 
-    def run_command(self, command, password=None):
-        from subprocess import Popen, PIPE
-        if not isinstance(command, list):
-            command = command.split()
-        proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-        if password is not None:
-            stdout, stderr = proc.communicate('{}\n'.format(password).encode())
-        else:
-            stdout, stderr = proc.communicate()
-        if stderr and 'incorrect password attempt' in stderr:
-            self.api_errors.append('Incorrect password attempt')
-            self._logger.error(stderr)
-        else:
-            return stdout
+    def command_runner(self):
+        if getattr(self, '_command_runner', None) is None:
+            self._command_runner = CommandRunner(self.on_command_update)
+        return self._command_runner
+
+    def on_command_update(self, job):
+        """Tell the frontend how a setup command is getting on. Once it has
+        finished, the wizard details are checked again and sent along."""
+        message = {'type': 'job', 'job': job}
+        if job['state'] not in ('queued', 'running'):
+            self._logger.info('{} command finished: {}'.format(job['command'], job['state']))
+            if job['error']:
+                self._logger.error('{} command failed: {}'.format(job['command'], job['error']))
+            self.wizard_checks().invalidate()
+            message['details'] = self.get_wizard_details()
+        self._plugin_manager.send_plugin_message(self._identifier, message)
 
     def adduser_done(self):
-        user_groups = [g.gr_name for g in grp.getgrall() if 'pi' in g.gr_mem]
-        return 'gpio' in user_groups
+        return self.wizard_checks().adduser_done()
 
     def spi_enabled(self):
-        with open('/boot/config.txt') as file:
-            for line in file:
-                if line.startswith('dtparam=spi=on'):
-                    return True
-        return False
+        return self.wizard_checks().spi_enabled()
 
     def buffer_increased(self):
-        with open('/boot/cmdline.txt') as file:
-            for line in file:
-                if 'spidev.bufsiz=' in line:
-                    return True
-        return False
+        return self.wizard_checks().buffer_increased()
 
     def frequency_set(self):
-        with open('/boot/config.txt') as file:
-            for line in file:
-                if line.startswith('core_freq=250'):
-                    return True
-        return False
+        return self.wizard_checks().frequency_set()
 
     def build_response(self):
         import flask
         details = self.get_wizard_details()
         details.update({
             'errors': self.api_errors,
-            'lightsOn': getattr(self, '_lightsOn', True)
+            'metrics': self.renderer_metrics(),
         })
+        details.update(self.light_state())
         self.api_errors = []
         return flask.jsonify(details)
 
     def on_api_command(self, command, data):
-        output = ''
         self._logger.info('{} command called'.format(command))
         password = data.get('password', None)
         cmd = ''
         if command == 'flipswitch':
             import flask
-            if getattr(self, '_lightsOn', True):
-                self.run_effect('Solid Color', (0, 0, 0,), delay=10, force=True)
-                self._lightsOn = False
-            else:
-                self._lightsOn = True
-                self.run_idle_effect()
-            return flask.jsonify({'lightsOn': self._lightsOn})
+            lights_on = not getattr(self, '_lights_wanted', getattr(self, '_lightsOn', True))
+            self.switch_lights(lights_on)
+            return flask.jsonify({'lightsOn': lights_on})
+        if command == 'metrics':
+            import flask
+            return flask.jsonify(self.renderer_metrics())
+        if command == 'preview':
+            import flask
+            self.set_preview(data.get('active', True))
+            return flask.jsonify({'lease': PREVIEW_LEASE})
+        if command == 'frame':
+            import flask
+            try:
+                rgb = base64.b64decode(data['pixels'])
+            except (TypeError, ValueError):
+                return flask.make_response('pixels must be base64 encoded RGB', 400)
+            return flask.jsonify({'shown': self.show_frame(rgb)})
+        if command == 'job':
+            import flask
+            try:
+                job = self.command_runner().job(int(data['id']))
+            except (TypeError, ValueError):
+                job = None
+            if job is None:
+                return flask.make_response('Unknown job', 404)
+            return flask.jsonify(job)
+        checks = self.wizard_checks()
         if command == 'adduser':
             cmd = 'sudo -S adduser pi gpio' 
         elif command == 'enable_spi' and not self.spi_enabled():
-            cmd = ['sudo', '-S', 'bash', '-c', 'echo dtparam=spi=on >> /boot/config.txt']
+            cmd = ['sudo', '-S', 'bash', '-c', 'echo dtparam=spi=on >> {}'.format(checks.config_path)]
         elif command == 'increase_buffer' and not self.buffer_increased():
-            cmd = ['sudo', '-S', 'sed', '-i', '$ s/$/ spidev.bufsiz=32768/', '/boot/cmdline.txt']
+            cmd = ['sudo', '-S', 'sed', '-i', '$ s/$/ spidev.bufsiz=32768/', checks.cmdline_path]
         elif command == 'set_frequency' and not self.frequency_set():
-            cmd = ['sudo', '-S', 'bash', '-c', 'echo core_freq=250 >> /boot/config.txt']
+            cmd = ['sudo', '-S', 'bash', '-c', 'echo core_freq=250 >> {}'.format(checks.config_path)]
         elif command == 'reboot':
             cmd = ['sudo', 'reboot']
         if cmd:
-            stdout = self.run_command(cmd, password=password)
+            import flask
+            job_id = self.command_runner().submit(command, cmd, password=password, timeout=COMMAND_TIMEOUTS[command])
+            return flask.jsonify({'job': job_id})
 
         return self.build_response()
 
     def on_api_get(self, request):
         return self.build_response()
 
+    def switch_lights(self, lights_on):
+        """Turn the lights on or off on a thread of its own, in case the
+        renderer has to be started first. Everyone gets told about the new
+        state with a plugin message once it has been applied."""
+        self._lights_wanted = lights_on
+        thread = threading.Thread(target=self.apply_lights, name='RGB Status Switch')
+        thread.daemon = True
+        thread.start()
+
+    def apply_lights(self):
+        with self._lights_lock:
+            lights_on = self._lights_wanted
+            if lights_on == getattr(self, '_lightsOn', True):
+                return
+            if lights_on:
+                self._lightsOn = True
+                self.run_idle_effect()
+            else:
+                self.run_effect('Solid Color', (0, 0, 0,), delay=10, force=True, blackout=True)
+                self._lightsOn = False
+            self.send_light_state()
+
+    def light_state(self):
+        return {
+            'lightsOn': getattr(self, '_lightsOn', True),
+            'effect': getattr(self, '_effect_name', None),
+            'colors': list(getattr(self, '_effect_colors', [])),
+        }
+
+    def send_light_state(self):
+        """Push the light state to every browser, if it changed."""
+        state = self.light_state()
+        if state != getattr(self, '_sent_light_state', None):
+            self._sent_light_state = state
+            message = {'type': 'lights'}
+            message.update(state)
+            self._plugin_manager.send_plugin_message(self._identifier, message)
+
     def get_settings_defaults(self):
         return {
             'led_count': 10,
@@ -171,11 +249,27 @@ class RGBStatusPlugin(
             'led_channel': 0,
             'strip_type': 'WS2811_STRIP_GRB',
             'leds_reversed': False,
+            'target_fps': 50,
+            'led_gamma': 1.0,
+            'transition_time': 500,
+            'segments': [],
+            'extra_strips': [],
+            'custom_effects': [],
+            'output_backend': 'neopixel',
+            'ddp_host': '',
+            'ddp_port': 4048,
+            'recording_path': '',
+            'metrics_log_interval': 300,
+            'boot_path': '/boot',
 
             'show_progress': True,
             'progress_base_color': '#ffffff',
             'progress_color': '#00ff00',
 
+            'show_heating': True,
+            'heating_base_color': '#0000ff',
+            'heating_color': '#ff0000',
+
             'init_effect': 'Rainbow Cycle',
             'init_effect_color': None,
             'init_effect_delay': 20,
@@ -202,10 +296,20 @@ class RGBStatusPlugin(
             'disconnected_effect_delay': 10,
         }
 
+    def get_settings_version(self):
+        return 2
+
+    def on_settings_migrate(self, target, current):
+        if current is None or current < 2:
+            for state in EFFECT_STATES:
+                scale = LEGACY_DELAY_SCALE.get(self._settings.get(['{}_effect'.format(state)]))
+                if scale is not None:
+                    delay_key = '{}_effect_delay'.format(state)
+                    self._settings.set_int([delay_key], self._settings.get_int([delay_key]) * scale)
+
     def on_settings_save(self, data):
-        old_strip_settings = {}
-        for setting in STRIP_SETTINGS:
-            old_strip_settings[setting] = self._settings.get([setting])
+        old_output_config = self.output_config()
+        old_renderer_settings = self.renderer_config()
 
         old_idle_settings = {}
         for setting in IDLE_SETTINGS:
@@ -214,11 +318,21 @@ class RGBStatusPlugin(
         for setting in DISCONNECTED_SETTINGS:
             old_disconnected_settings[setting] = self._settings.get([setting])
 
+        old_segments = self.segment_payloads()
+        old_custom_effects = self._custom_effects
         changed_settings = plugin.SettingsPlugin.on_settings_save(self, data)
-        for setting in STRIP_SETTINGS:
-            if old_strip_settings[setting] != self._settings.get([setting]):
-                self.init_strip()
-                break
+        self.compile_profiles()
+        effect_name = getattr(self, '_effect_name', None)
+        if effect_name in old_custom_effects and old_custom_effects[effect_name] != self._custom_effects.get(effect_name):
+            # The effect that is running was changed or removed
+            if getattr(self, '_state', None) in EFFECT_STATES:
+                self.run_profile(self._state)
+        if old_segments != self.segment_payloads() and self.renderer_is_alive():
+            self._queue.put(('segments', self.segment_payloads()))
+        if old_output_config != self.output_config():
+            self.init_strip()
+        if old_renderer_settings != self.renderer_config() and self.renderer_is_alive():
+            self._queue.put(('config', self.renderer_config()))
         if self._printer.is_operational():
             for setting in IDLE_SETTINGS:
                 if old_idle_settings[setting] != self._settings.get([setting]):
@@ -238,7 +352,7 @@ class RGBStatusPlugin(
         ]
 
     def get_template_vars(self):
-        return {'effects': EFFECTS, 'strip_types': STRIP_TYPES}
+        return {'effects': self.all_effects(), 'strip_types': STRIP_TYPES, 'output_backends': OUTPUT_BACKENDS}
 
     def get_assets(self):
         return {
@@ -246,30 +360,75 @@ class RGBStatusPlugin(
             'css': ['css/rgb_status.css']
         }
 
+    def strip_configs(self):
+        """The main strip followed by the extra strips, each a dict of the
+        STRIP_SETTINGS. Settings left out of an extra strip are taken from
+        the main strip."""
+        main = {setting: self._settings.get([setting]) for setting in STRIP_SETTINGS}
+        configs = []
+        for strip in [main] + list(self._settings.get(['extra_strips']) or []):
+            config = {}
+            try:
+                for setting in STRIP_SETTINGS:
+                    value = strip.get(setting)
+                    if value is None or value == '':
+                        value = main[setting]
+                    if setting == 'led_invert':
+                        config[setting] = value in (True, 'true', 'True', 1)
+                    elif setting == 'strip_type':
+                        if value not in STRIP_TYPES:
+                            raise ValueError(value)
+                        config[setting] = value
+                    else:
+                        config[setting] = int(value)
+            except (TypeError, ValueError):
+                self._logger.warn('Ignoring strip with invalid settings: {}'.format(strip))
+                continue
+            configs.append(config)
+        return configs
+
+    def output_config(self):
+        """Everything the renderer needs to open the output, see open_output()."""
+        backend = self._settings.get(['output_backend'])
+        if backend == 'ddp':
+            return {
+                'backend': backend,
+                'host': self._settings.get(['ddp_host']),
+                'port': self._settings.get_int(['ddp_port']),
+                'led_count': self._settings.get_int(['led_count']),
+            }
+        if backend == 'null':
+            return {'backend': backend, 'led_count': self._settings.get_int(['led_count'])}
+        if backend == 'recording':
+            return {
+                'backend': backend,
+                'path': self._settings.get(['recording_path']) or os.path.join(self.get_plugin_data_folder(), 'recording.rgbs'),
+                'led_count': self._settings.get_int(['led_count']),
+            }
+        return {'backend': backend, 'strips': self.strip_configs()}
+
+    def output_led_count(self, config):
+        if 'strips' in config:
+            return sum(strip['led_count'] for strip in config['strips'])
+        return config['led_count']
+
     def init_strip(self):
-        settings = []
-        for setting in STRIP_SETTINGS:
-            if setting == 'led_invert':
-                settings.append(self._settings.get_boolean([setting]))
-            elif setting == 'strip_type':
-                settings.append(STRIP_TYPES.get(self._settings.get([setting])))
-            else:
-                settings.append(self._settings.get_int([setting]))
         try:
-            #self.strip = Adafruit_NeoPixel(*settings)
-            #self.strip.begin()
+            settings = self.output_config()
             self.strip = settings
+            with self._renderer_lock:
+                if self.renderer_is_alive():
+                    self._queue.put(('output', settings))
+                else:
+                    self.start_renderer()
             self._lightsOn = True
         except Exception as e:
             self._logger.error(e)
             self.strip = None
             self._lightsOn = False
-        self.run_effect(
-            self._settings.get(['init_effect']),
-            hex_to_rgb(self._settings.get(['init_effect_color'])),
-            self._settings.get_int(['init_effect_delay']),
-            min_time=self._settings.get_int(['init_effect_min_time'])
-        )
+        self._lights_wanted = self._lightsOn
+        self.send_light_state()
+        self.run_profile('init')
         if self._printer.is_operational():
             self.run_idle_effect()
         else:
@@ -280,56 +439,91 @@ class RGBStatusPlugin(
             self.context = multiprocessing.get_context('spawn')
         else:
             self.context = multiprocessing
-        self.init_strip()
+        self._heating_monitor = HeatingMonitor()
+        self._lights_lock = threading.Lock()
+        self._renderer_lock = threading.RLock()
+        self._backoff = RestartBackoff()
+        self._stopping = threading.Event()
+        self.compile_profiles()
+        self._printer.register_callback(self)
+        supervisor = threading.Thread(target=self.supervise, name='RGB Status Supervisor')
+        supervisor.daemon = True
+        supervisor.start()
+        # Starting the renderer and the init effect should not hold up the
+        # rest of OctoPrint's startup. Events coming in before the strip is
+        # set up are covered by the idle or disconnected effect it ends with.
+        thread = threading.Thread(target=self.init_strip, name='RGB Status Startup')
+        thread.daemon = True
+        thread.start()
+
+    def compile_profiles(self):
+        """Parse everything events need out of the settings, so that handling
+        an event does not touch the settings at all."""
+        self._profiles = build_profiles(self._settings)
+        self._options = build_options(self._settings, self.output_led_count(self.output_config()))
+        self._segments = build_segments(self._settings)
+        self._custom_effects, errors = compile_effects(
+            self._settings.get(['custom_effects']), reserved=list(EFFECTS) + list(STATUS_EFFECTS))
+        for error in errors:
+            self._logger.warn(error)
+
+    def all_effects(self):
+        """The built in effects and the custom effects from the settings."""
+        effects = dict(EFFECTS)
+        effects.update(getattr(self, '_custom_effects', {}))
+        return effects
+
+    def find_effect(self, effect_name):
+        return STATUS_EFFECTS.get(effect_name) or EFFECTS.get(effect_name) or self._custom_effects.get(effect_name)
+
+    def segment_payloads(self):
+        payloads = []
+        for segment in self._segments:
+            effect = self.find_effect(segment.effect_name)
+            if effect is None:
+                self._logger.warn('The effect {} of segment {} was not found'.format(segment.effect_name, segment.name))
+                continue
+            payloads.append({
+                'start': segment.start,
+                'end': segment.end,
+                'effect': effect,
+                'color': segment.color,
+                'delay': segment.delay,
+                'reverse': self._options.leds_reversed,
+                'kwargs': {},
+            })
+        return payloads
+
+    def run_profile(self, state, **kwargs):
+        profile = self._profiles[state]
+        effect_kwargs = dict(profile.kwargs)
+        effect_kwargs.update(kwargs)
+        self.run_effect(profile.effect_name, profile.color, profile.delay, min_time=profile.min_time, **effect_kwargs)
+        self._state = state
 
     def run_idle_effect(self):
         self._logger.info('Starting Idle Effect')
-        self.run_effect(
-            self._settings.get(['idle_effect']),
-            hex_to_rgb(self._settings.get(['idle_effect_color'])),
-            self._settings.get_int(['idle_effect_delay']),
-        )
+        self.run_profile('idle')
 
     def run_pause_effect(self):
         self._logger.info('Starting Pause Effect')
-        self.run_effect(
-            self._settings.get(['pause_effect']),
-            hex_to_rgb(self._settings.get(['pause_effect_color'])),
-            self._settings.get_int(['pause_effect_delay']),
-        )
+        self.run_profile('pause')
 
     def run_fail_effect(self):
         self._logger.info('Starting Fail Effect')
-        self.run_effect(
-            self._settings.get(['fail_effect']),
-            hex_to_rgb(self._settings.get(['fail_effect_color'])),
-            self._settings.get_int(['fail_effect_delay']),
-        )
+        self.run_profile('fail')
 
     def run_done_effect(self):
         self._logger.info('Starting Done Effect')
-        self.run_effect(
-            self._settings.get(['done_effect']),
-            hex_to_rgb(self._settings.get(['done_effect_color'])),
-            self._settings.get_int(['done_effect_delay']),
-        )
+        self.run_profile('done')
 
     def run_disconnected_effect(self):
         self._logger.info('Starting Disconnected Effect')
-        self.run_effect(
-            self._settings.get(['disconnected_effect']),
-            hex_to_rgb(self._settings.get(['disconnected_effect_color'])),
-            self._settings.get_int(['disconnected_effect_delay']),
-        )
+        self.run_profile('disconnected')
 
     def on_event(self, event, payload):
         if event == 'PrintStarted':
-            self.run_effect(
-                'Progress',
-                hex_to_rgb(self._settings.get(['progress_base_color'])),
-                progress=0,
-                progress_color=hex_to_rgb(self._settings.get(['progress_color'])),
-            )
+            self.run_profile('progress', progress=0)
         elif event == 'PrintFailed':
             self.run_fail_effect()
         elif event == 'PrintPaused':
@@ -344,89 +538,284 @@ class RGBStatusPlugin(
             self.run_disconnected_effect()
 
     def on_print_progress(self, storage, path, progress):
-        if progress == 100 and hasattr(self, '_effect') and self._effect.is_alive() and self._effect.name != 'Progress':
+        if progress == 100 and self.renderer_is_alive() and getattr(self, '_effect_name', None) != 'Progress':
             self._logger.info('Progress was set to 100, but the idle effect was already running. Ignoring progress update')
             return
-        if self.strip is not None and self._settings.get_boolean(['show_progress']):
+        if getattr(self, '_state', None) == 'heating' and progress < 100:
+            # The progress bar comes back once the heaters are done
+            return
+        if getattr(self, 'strip', None) is not None and self._options.show_progress:
             self._logger.info('Updating Progress LEDs: ' + str(progress))
-            if self._effect.name != 'Progress':
-                self.run_effect(
-                    'Progress',
-                    hex_to_rgb(self._settings.get(['progress_base_color'])),
-                    progress=progress,
-                    progress_color=hex_to_rgb(self._settings.get(['progress_color'])),
-                )
-            elif hasattr(self, '_queue'):
-                self._queue.put(progress)
-        elif self.strip is None:
+            if getattr(self, '_effect_name', None) != 'Progress':
+                self.run_profile('progress', progress=progress)
+            else:
+                self.update_progress(progress)
+        elif hasattr(self, 'strip') and self.strip is None:
             self._logger.error('Error setting progress: The strip object does not exist. Did it fail to initialize?')
 
-    def effect_is_alive(self):
-        return hasattr(self, '_effect') and self._effect.is_alive()
-
-    def effect_can_be_killed(self, force=False):
-        if not self.effect_is_alive():
-            self._logger.info("effect is not alive. It can't be killed")
-            return False
-        if force or self._effect.end_ts < datetime.now():
-            return True
+    def on_printer_send_current_data(self, data):
+        # The current data carries the fractional completion, which moves
+        # the bar smoothly between the whole percents of on_print_progress.
+        completion = (data.get('progress') or {}).get('completion')
+        if completion is not None and getattr(self, '_effect_name', None) == 'Progress' and self._printer.is_printing():
+            self.update_progress(completion)
+
+    def on_printer_add_temperature(self, data):
+        progress = self._heating_monitor.update(data)
+        state = getattr(self, '_state', None)
+        if progress is None:
+            if state == 'heating':
+                self.finish_heating()
+            return
+        if not self._options.show_heating or getattr(self, 'strip', None) is None or state not in HEATING_STATES:
+            return
+        if state != 'heating':
+            self._logger.info('Starting Heating Effect')
+            self.run_profile('heating', progress=progress)
         else:
-            return False
-
-    def kill_effect(self, force=False):
-        while self.effect_is_alive():
-            if self.effect_can_be_killed(force=force):
-                self._logger.info('Putting KILL code in queue')
-                self._queue.put('KILL')
-                delattr(self, '_queue')
-                self._shutdown_event.set()
-                delattr(self, '_shutdown_event')
-                self._logger.info('Joining Effect process')
-                self._effect.join(3)
-                if self._effect.is_alive():
-                    self._logger.info('Terminating effect')
-                    self._effect.terminate()
-                self._logger.info('Killed effect: ' + self._effect.name)
-                break
+            # Temperatures are reported twice a second, but the bar only
+            # needs to move when it covers another pixel.
+            self.update_progress(progress, steps_per_pixel=1)
+
+    def finish_heating(self):
+        if self._printer.is_printing():
+            completion = (self._printer.get_current_data().get('progress') or {}).get('completion') or 0
+            self.run_profile('progress', progress=completion)
+        elif self._printer.is_operational():
+            self.run_idle_effect()
         else:
-            self._logger.info('Effect is not alive')
+            self.run_disconnected_effect()
 
-    def run_effect(self, effect_name, color=None, delay=50, min_time=0, force=False, **kwargs):
+    def update_progress(self, progress, steps_per_pixel=256):
+        """Forward a progress value to the renderer unless it would render
+        the same bar as the last one that was sent, at steps_per_pixel
+        steps per pixel."""
+        self._progress = progress
+        step = int(float(progress) * self._options.led_count * steps_per_pixel / 100)
+        if step != getattr(self, '_progress_step', None) and self.renderer_is_alive():
+            self._progress_step = step
+            self._queue.put(('progress', progress))
+
+    def renderer_is_alive(self):
+        return hasattr(self, '_renderer') and self._renderer.is_alive()
+
+    def renderer_config(self):
+        return build_renderer_config(self._settings)
+
+    def renderer_metrics(self):
+        """The latest metrics reported by the renderer."""
+        metrics = dict(getattr(self, '_metrics', None) or {})
+        if 'received' in metrics:
+            metrics['age'] = monotonic() - metrics.pop('received')
+        metrics.update({
+            'alive': self.renderer_is_alive(),
+            'restarts': getattr(self, '_renderer_restarts', 0),
+            'failures': getattr(self, '_renderer_failures', 0),
+            'last_failure': getattr(self, '_renderer_failure', None),
+        })
+        backoff = getattr(self, '_backoff', None)
+        if backoff is not None and backoff.pending():
+            metrics['restart_in'] = max(backoff.restart_at - monotonic(), 0)
+        return metrics
+
+    def receive_status(self, status_queue):
+        """Runs on a thread for as long as status_queue belongs to the
+        current renderer, handling what the renderer reports."""
+        from six.moves.queue import Empty
+        last_logged = monotonic()
+        while getattr(self, '_status_queue', None) is status_queue:
+            try:
+                command, payload = status_queue.get(timeout=1)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if command == 'preview':
+                self._plugin_manager.send_plugin_message(self._identifier, {
+                    'type': 'preview',
+                    'pixels': base64.b64encode(payload).decode('ascii'),
+                })
+            elif command == 'error':
+                self._logger.error('Renderer: {}'.format(payload))
+            elif command == 'metrics':
+                payload['received'] = monotonic()
+                self._metrics = payload
+                interval = self._settings.get_int(['metrics_log_interval'])
+                if interval and payload['received'] - last_logged >= interval:
+                    last_logged = payload['received']
+                    self._logger.info('Renderer metrics: {}'.format(self.renderer_metrics()))
+
+    def show_frame(self, rgb):
+        """Show a frame given as bytes, red, green and blue for every pixel,
+        until the next effect is started. The frame goes to the renderer
+        through shared memory. Available to other plugins as the show_frame
+        helper."""
+        if getattr(self, 'strip', None) is None or not getattr(self, '_lightsOn', False) or not self.renderer_is_alive():
+            return False
+        if self._frame_buffer.write_rgb(rgb):
+            self._queue.put(('frame', None))
+        if getattr(self, '_state', None) != 'external':
+            self._state = 'external'
+            self._effect_name = 'External'
+            self._effect_colors = []
+            self.send_light_state()
+        return True
+
+    def set_preview(self, active):
+        """Start or renew streaming the rendered frames to the frontend, or
+        stop it. The renderer stops by itself once the lease runs out."""
+        self._preview_until = monotonic() + PREVIEW_LEASE if active else 0
+        if self.renderer_is_alive():
+            self._queue.put(('preview', {
+                'lease': PREVIEW_LEASE if active else 0,
+                'fps': PREVIEW_FPS,
+                'max_pixels': PREVIEW_MAX_PIXELS,
+            }))
+
+    def start_renderer(self):
+        with self._renderer_lock:
+            if not self.renderer_is_alive():
+                self.spawn_renderer()
+
+    def spawn_renderer(self):
+        restart = hasattr(self, '_renderer')
+        if restart:
+            self._renderer_restarts = getattr(self, '_renderer_restarts', 0) + 1
+        self._queue = self.context.Queue()
+        self._status_queue = self.context.Queue()
+        self._shutdown_event = self.context.Event()
+        # 0 until the renderer is running
+        self._heartbeat = self.context.Value('d', 0.0, lock=False)
+        if getattr(self, '_frame_buffer', None) is None:
+            self._frame_buffer = FrameBuffer(self.context)
+        self._renderer = self.context.Process(
+            target=run_renderer,
+            args=(self._queue, self.strip, self._shutdown_event, self._status_queue, self._frame_buffer, self._heartbeat),
+            name='RGB Status Renderer'
+        )
+        self._renderer.daemon = True
+        self._renderer.start()
+        self._backoff.started_renderer()
+        status_thread = threading.Thread(target=self.receive_status, args=(self._status_queue,), name='RGB Status Reports')
+        status_thread.daemon = True
+        status_thread.start()
+        self._queue.put(('config', self.renderer_config()))
+        self._queue.put(('segments', self.segment_payloads()))
+        if restart:
+            self.restore_renderer()
+        self._logger.info('Started renderer {}'.format(self._renderer))
+
+    def restore_renderer(self):
+        """Bring a restarted renderer back to where the last one was: the
+        last effect with its latest progress, the external frame and the
+        preview stream."""
+        payload = getattr(self, '_effect_payload', None)
+        if payload is not None:
+            # Whatever the effect was holding the strip for is over
+            self._queue.put(('effect', dict(payload, min_time=0)))
+            if getattr(self, '_progress', None) is not None:
+                self._queue.put(('progress', self._progress))
+        self._frame_buffer.forget_notifications()
+        if getattr(self, '_state', None) == 'external':
+            self._queue.put(('frame', None))
+        lease = getattr(self, '_preview_until', 0) - monotonic()
+        if lease > 0:
+            self._queue.put(('preview', {'lease': lease, 'fps': PREVIEW_FPS, 'max_pixels': PREVIEW_MAX_PIXELS}))
+
+    def renderer_failure(self):
+        """Why the renderer is no longer working, or None if it is."""
+        if not self._renderer.is_alive():
+            return 'exited with code {}'.format(self._renderer.exitcode)
+        if not self._heartbeat.value:
+            if monotonic() - self._backoff.started > STARTUP_TIMEOUT:
+                return 'did not start'
+        elif monotonic() - self._heartbeat.value > HEARTBEAT_TIMEOUT:
+            return 'stopped responding'
+        return None
+
+    def supervise(self):
+        """Runs on a thread until shutdown. A renderer that exited or hangs
+        is stopped and started again, waiting longer after every failure
+        in a row."""
+        while not self._stopping.wait(CHECK_INTERVAL):
+            with self._renderer_lock:
+                if not hasattr(self, '_renderer') or self._stopping.is_set():
+                    continue
+                if self._backoff.pending():
+                    if self._backoff.due():
+                        self.spawn_renderer()
+                    continue
+                failure = self.renderer_failure()
+                if failure is None:
+                    continue
+                if self._renderer.is_alive():
+                    # A hung renderer may not get to handle SIGTERM
+                    os.kill(self._renderer.pid, signal.SIGKILL)
+                    self._renderer.join(1)
+                self._status_queue = None
+                self._renderer_failures = getattr(self, '_renderer_failures', 0) + 1
+                self._renderer_failure = failure
+                delay = self._backoff.failed()
+                self._logger.error('The renderer {}, restarting it in {:.0f} seconds'.format(failure, delay))
+
+    def stop_renderer(self):
+        self._stopping.set()
+        if not self.renderer_is_alive():
+            self._logger.info('Renderer is not alive')
+            return
+        self._logger.info('Putting KILL code in queue')
+        self._queue.put('KILL')
+        self._logger.info('Joining renderer process')
+        self._renderer.join(3)
+        self._shutdown_event.set()
+        if self._renderer.is_alive():
+            self._logger.info('Terminating renderer')
+            self._renderer.terminate()
+        self._status_queue = None
+        self._logger.info('Stopped renderer')
+
+    def run_effect(self, effect_name, color=None, delay=50, min_time=0, force=False, blackout=False, **kwargs):
+        """Start an effect on the whole strip. With blackout it covers the
+        segments as well, until the next effect starts."""
         if getattr(self, 'strip', None) is not None and getattr(self, '_lightsOn', False):
-            if effect_name == 'Progress':
-                effect = progress_effect
-            else:
-                effect = EFFECTS.get(effect_name)
+            effect = self.find_effect(effect_name)
             if effect is not None:
-                if not hasattr(self, '_lock'):
-                    self._lock = self.context.Lock()
-                self.kill_effect(force=force)
-                if not hasattr(self, '_queue'):
-                    self._queue = self.context.Queue()
-                if not hasattr(self, '_shutdown_event'):
-                    self._shutdown_event = self.context.Event()
-                reverse = self._settings.get_boolean(['leds_reversed'])
                 self._logger.info('Starting new effect {}'.format(effect_name))
-                self._effect = self.context.Process(
-                    target=run_effect,
-                    args=(effect, self._lock, self._queue, self.strip, color, delay, self._shutdown_event, reverse),
-                    kwargs=kwargs,
-                    name=effect_name
-                )
-                self._effect.start()
-                self._effect.end_ts = datetime.now() + timedelta(seconds=min_time)
-                self._logger.info('Started new effect {}'.format(self._effect))
+                self._effect_payload = {
+                    'name': effect_name,
+                    'effect': effect,
+                    'color': color,
+                    'delay': delay,
+                    'reverse': self._options.leds_reversed,
+                    'min_time': min_time,
+                    'force': force,
+                    'kwargs': kwargs,
+                    'blackout': blackout,
+                }
+                # A renderer that is down gets the effect once the
+                # supervisor has restarted it
+                if self.renderer_is_alive():
+                    self._queue.put(('effect', self._effect_payload))
+                self._effect_name = effect_name
+                self._effect_colors = [rgb_to_hex(value) for value in (color, kwargs.get('progress_color')) if value is not None]
+                self._progress_step = None
+                self._progress = None
+                self.send_light_state()
             else:
                 self._logger.warn('The effect {} was not found. Did you remove that effect?'.format(effect))
-        elif getattr(self, 'strip', None) is None:
+        elif hasattr(self, 'strip') and self.strip is None:
             self._logger.error('Error running effect: The strip object does not exist. Did it fail to initialize?')
 
     def on_shutdown(self):
         self._logger.info('Shutting down RGB Status:')
         self._logger.info('1. Turning off LEDs')
-        self.run_effect('Solid Color', (0, 0, 0,), delay=10, force=True)
-        self._logger.info('2. Killing the current effect')
-        self.kill_effect()
+        self.run_effect('Solid Color', (0, 0, 0,), delay=10, force=True, blackout=True)
+        self._printer.unregister_callback(self)
+        self._logger.info('2. Stopping the renderer')
+        self.stop_renderer()
+        if getattr(self, '_frame_buffer', None) is not None:
+            self._frame_buffer.close()
+            self._frame_buffer.unlink()
 
     def get_update_information(self, *args, **kwargs):
         return {
@@ -445,6 +834,9 @@ class RGBStatusPlugin(
 __plugin_name__ = 'RGB Status'
 __plugin_pythoncompat__ = ">=2.7,<4"
 __plugin_implementation__ = RGBStatusPlugin()
+__plugin_helpers__ = {
+    'show_frame': __plugin_implementation__.show_frame,
+}
 __plugin_hooks__ = {
     'octoprint.plugin.softwareupdate.check_config': __plugin_implementation__.get_update_information,
 }
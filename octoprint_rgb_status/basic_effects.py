@@ -1,91 +1,127 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
-from rpi_ws281x import *
 from .utils import blend_colors
-from datetime import datetime
-import time
-import traceback
+from .frames import Color, new_frame, frame_from, cached_cycle
 from six.moves import range
-
-
-def run_effect(effect, lock, queue, settings, color, delay, shutdown_event, reverse=False, **kwargs):
-    lock.acquire()
-    strip = Adafruit_NeoPixel(*settings)
-    strip.begin()
-    try:
-        while not shutdown_event.is_set():
-           if not queue.empty():
-               message = queue.get()
-               if message == 'KILL':
-                   break
-               elif 'progress' in kwargs:
-                   kwargs['progress'] = int(message)
-           effect(strip, color, queue, delay, reverse=reverse, **kwargs)
-    finally:
-        lock.release()
-        while not queue.empty():
-            msg = queue.get_nowait()
-        queue.close()
-        queue.join_thread()
-
-def progress_effect(strip, color, queue, delay=0, iterations=1, reverse=False, progress=0, progress_color=None):
-   perc = float(progress) / 100 * float(strip.numPixels())
-   pixels_range = list(range(strip.numPixels()))
-   if reverse:
-       pixels_range = reversed(pixels_range)
-   for i, p in enumerate(pixels_range):
-       if i+1 <= int(perc):
-           strip.setPixelColorRGB(p, *progress_color)
-       elif i+1 == int(perc)+1:
-           strip.setPixelColorRGB(p, *blend_colors(color, progress_color, (perc % 1)))
-       else:
-           strip.setPixelColorRGB(p, *color)
-   strip.show()
+import colorsys
+import math
+
+# Every effect is a generator function taking the number of pixels and
+# yielding whole frames (see frames.py). Each frame is one step of the
+# animation and lasts delay milliseconds. When the generator is exhausted
+# the renderer starts it again. Frames that are yielded may be shared with
+# the frame cache and must not be modified. An effect may also yield a
+# (frame, start, end) tuple when only that span of pixels has changed.
+
+
+def static(effect):
+    """Mark an effect that yields a single frame which only changes when the
+    effect is restarted, so the renderer can stop redrawing it."""
+    effect.static = True
+    return effect
+
+
+def incremental(effect):
+    """Mark an effect whose generator takes progress updates through send()
+    instead of being restarted for every update."""
+    effect.incremental = True
+    return effect
+
+
+def seekable(effect):
+    """Mark an effect that takes a step argument and starts at that step of
+    its run, so steps the renderer skips are never built. The run starts
+    over at step 0 once the generator is exhausted. Effects replaying a
+    cached cycle skip cheaply without this."""
+    effect.seekable = True
+    return effect
+
+
+def scale_color(color, brightness):
+    """Scale a packed color the same way the ws281x driver applies brightness."""
+    scale = brightness + 1
+    return Color(
+        (((color >> 16) & 255) * scale) >> 8,
+        (((color >> 8) & 255) * scale) >> 8,
+        ((color & 255) * scale) >> 8,
+    )
+
+
+@static
+@incremental
+def progress_effect(num_pixels, color, delay=0, iterations=1, reverse=False, progress=0, progress_color=None):
+    """Progress bar which repaints only the pixels between the previous and
+    the new progress value. progress may be fractional."""
+    base = Color(*color)
+    complete = Color(*progress_color)
+    frame = new_frame(num_pixels, base)
+    previous = 0
+    start, end = 0, num_pixels
+    while True:
+        perc = float(progress) / 100 * float(num_pixels)
+        done = min(int(perc), num_pixels)
+        low = min(previous, done)
+        high = min(max(previous, done) + 1, num_pixels)
+        for i in range(low, high):
+            if i < done:
+                pixel = complete
+            elif i == done:
+                pixel = Color(*blend_colors(color, progress_color, (perc % 1)))
+            else:
+                pixel = base
+            frame[num_pixels - 1 - i if reverse else i] = pixel
+        if reverse:
+            low, high = num_pixels - high, num_pixels - low
+        previous = done
+        update = yield frame, min(start, low), max(end, high)
+        if update is not None:
+            progress = update
+        start, end = num_pixels, 0
+
+@static
+def external_frame(num_pixels, color, delay=0, iterations=1, reverse=False, frame=None):
+    """A frame sent in from outside the plugin, shown as it is."""
+    yield frame if frame is not None else new_frame(num_pixels)
 
 # Define functions which animate LEDs in various ways.
-def solid_color(strip, color, queue, delay=0, iterations=1, reverse=False):
-    for p in range(strip.numPixels()):
-        strip.setPixelColorRGB(p, *color)
-    strip.show()
+@static
+def solid_color(num_pixels, color, delay=0, iterations=1, reverse=False):
+    yield new_frame(num_pixels, Color(*color))
 
 
-def color_wipe(strip, color, queue, delay=50, iterations=1, reverse=False):
+@seekable
+def color_wipe(num_pixels, color, delay=50, iterations=1, reverse=False, step=0):
     """Wipe color across display a pixel at a time."""
-    pixels_range = list(range(strip.numPixels()))
+    pixels_range = list(range(num_pixels))
     if reverse:
         pixels_range = list(reversed(pixels_range))
-
-    for i in range(iterations):
-        for p in pixels_range:
-            strip.setPixelColorRGB(p, *color)
-            strip.show()
-            if not queue.empty():
-                return
-            time.sleep(delay/100.0)
-        for p in pixels_range:
-            strip.setPixelColorRGB(p, 0, 0, 0)
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/100.0)
-
-
-def theater_chase(strip, color, queue, delay=50, iterations=10, reverse=False):
+    color = Color(*color)
+
+    first, start = divmod(step % ((num_pixels + 1) * iterations), num_pixels + 1)
+    for i in range(first, iterations):
+        frame = new_frame(num_pixels)
+        for p in pixels_range[:start]:
+            frame[p] = color
+        for p in pixels_range[start:]:
+            frame = frame[:]
+            frame[p] = color
+            yield frame
+        yield new_frame(num_pixels)
+        start = 0
+
+
+def theater_chase(num_pixels, color, delay=50, iterations=10, reverse=False):
     """Movie theater light style chaser animation."""
-    pixels_range = list(range(0, strip.numPixels(), 3))
-    if reverse:
-        pixels_range = list(reversed(pixels_range))
+    color = Color(*color)
+    frames = []
+    for r in range(3):
+        frame = new_frame(num_pixels)
+        frame[r::3] = new_frame(len(frame[r::3]), color)
+        frames.append(frame)
 
     for i in range(iterations):
-        for r in range(3):
-            for p in pixels_range:
-                strip.setPixelColorRGB(p+r, *color)
-            strip.show()
-            if not queue.empty():
-                return
-            time.sleep(delay/1000.0)
-            for p in pixels_range:
-                strip.setPixelColor(p+r, 0)
+        for frame in frames:
+            yield frame
 
 
 def wheel(pos):
@@ -100,107 +136,115 @@ def wheel(pos):
         return Color(0, pos * 3, 255 - pos * 3)
 
 
-def rainbow(strip, color, queue, delay=20, iterations=1, reverse=False):
+WHEEL = [wheel(pos) for pos in range(256)]
+
+
+def rainbow_frame(num_pixels, i):
+    return frame_from([WHEEL[(p+i) & 255] for p in range(num_pixels)])
+
+
+def rainbow_cycle_frame(num_pixels, i):
+    return frame_from([WHEEL[(int(p * 256 / num_pixels) + i) & 255] for p in range(num_pixels)])
+
+
+def rainbow(num_pixels, color, delay=20, iterations=1, reverse=False):
     """Draw rainbow that fades across all pixels at once."""
-    for i in range(256*iterations):
-        for p in range(strip.numPixels()):
-            strip.setPixelColor(p, wheel((p+i) & 255))
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/1000.0)
+    def build():
+        for i in range(256):
+            yield rainbow_frame(num_pixels, i)
 
+    for i in range(iterations):
+        for frame in cached_cycle(('rainbow', num_pixels), build):
+            yield frame
 
-def rainbow_cycle(strip, color, queue, delay=20, iterations=5, reverse=False):
+
+def rainbow_cycle(num_pixels, color, delay=20, iterations=5, reverse=False):
     """Draw rainbow that uniformly distributes itself across all pixels."""
-    for i in range(256*iterations):
-        for p in range(strip.numPixels()):
-            strip.setPixelColor(p, wheel((int(p * 256 / strip.numPixels()) + i) & 255))
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/1000.0)
+    def build():
+        for i in range(256):
+            yield rainbow_cycle_frame(num_pixels, i)
+
+    for i in range(iterations):
+        for frame in cached_cycle(('rainbow_cycle', num_pixels), build):
+            yield frame
 
 
-def theater_chase_rainbow(strip, color, queue, delay=50, iterations=1, reverse=False):
+def theater_chase_rainbow(num_pixels, color, delay=50, iterations=1, reverse=False):
     """Rainbow movie theater light style chaser animation."""
-    for i in range(256*iterations):
-        for r in range(3):
-            for p in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(p+r, wheel((p+i) % 255))
-            strip.show()
-            if not queue.empty():
-                return
-            time.sleep(delay/1000.0)
-            for p in range(0, strip.numPixels(), 3):
-                strip.setPixelColor(p+r, 0)
-
-
-def pulse(strip, color, queue, delay, iterations=1, reverse=False):
-    for p in range(strip.numPixels()):
-        strip.setPixelColorRGB(p, *color)
-    for i in range(255):
-        strip.setBrightness(i)
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/1000.0)
-    for i in reversed(list(range(255))):
-        strip.setBrightness(i)
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/1000.0)
-
-
-def knight_rider(strip, color, queue, delay, iterations=1, reverse=False):
-    for active_pixel in range(strip.numPixels()):
-        for i in range(strip.numPixels()):
-            if i == active_pixel or i+1 == active_pixel or i-1 == active_pixel:
-                strip.setPixelColorRGB(i, *color)
-            else:
-                strip.setPixelColorRGB(i, *(0,0,0))
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/100.0)
-    for active_pixel in reversed(list(range(strip.numPixels()))):
-        for i in range(strip.numPixels()):
-            if i == active_pixel or i+1 == active_pixel or i-1 == active_pixel:
-                strip.setPixelColorRGB(i, *color)
-            else:
-                strip.setPixelColorRGB(i, *(0,0,0))
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/100.0)
-        
-
-def plasma(strip, color, queue, delay, iterations=1000, reverse=False):
-    import colorsys
-    import math
-    pixels_range = list(range(strip.numPixels()))
-    iterations_range = list(range(iterations))
-    for f in iterations_range:
-        for i in pixels_range:
-            x = f + i
-            hue = 4.0 + math.sin(x / 19.0) + math.sin(i / 9.0) + math.sin((x + i) / 25.0) + math.sin(math.sqrt(x**2.0 + i**2.0) / 8.0)
-            rgb = colorsys.hsv_to_rgb(hue/8.0, 1, 1)
-            color = tuple([int(round(c * 255.0)) for c in rgb])
-            strip.setPixelColorRGB(i, *color)
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/50.0)
-
-    for f in reversed(iterations_range):
-        for i in pixels_range:
-            x = f + i
-            hue = 4.0 + math.sin(x / 19.0) + math.sin(i / 9.0) + math.sin((x + i) / 25.0) + math.sin(math.sqrt(x**2.0 + i**2.0) / 8.0)
-            rgb = colorsys.hsv_to_rgb(hue/8.0, 1, 1)
-            color = tuple([int(round(c * 255.0)) for c in rgb])
-            strip.setPixelColorRGB(i, *color)
-        strip.show()
-        if not queue.empty():
-            return
-        time.sleep(delay/50.0)
+    def build():
+        for i in range(256):
+            for r in range(3):
+                frame = new_frame(num_pixels)
+                for p in range(0, num_pixels - r, 3):
+                    frame[p+r] = WHEEL[(p+i) % 255]
+                yield frame
+
+    for i in range(iterations):
+        for frame in cached_cycle(('theater_chase_rainbow', num_pixels), build):
+            yield frame
+
+
+@seekable
+def pulse(num_pixels, color, delay, iterations=1, reverse=False, step=0):
+    color = Color(*color)
+    # Up through brightness 0-254 and back down
+    for i in range(step % 510, 510):
+        yield new_frame(num_pixels, scale_color(color, i if i < 255 else 509 - i))
+
+
+@seekable
+def knight_rider(num_pixels, color, delay, iterations=1, reverse=False, step=0):
+    color = Color(*color)
+    active_range = list(range(num_pixels))
+    positions = active_range + list(reversed(active_range))
+    for active_pixel in positions[step % max(len(positions), 1):]:
+        frame = new_frame(num_pixels)
+        start = max(active_pixel - 1, 0)
+        end = min(active_pixel + 2, num_pixels)
+        frame[start:end] = new_frame(end - start, color)
+        yield frame
+
+
+def plasma_color(i, f):
+    x = f + i
+    hue = 4.0 + math.sin(x / 19.0) + math.sin(i / 9.0) + math.sin((x + i) / 25.0) + math.sin(math.sqrt(x**2.0 + i**2.0) / 8.0)
+    rgb = colorsys.hsv_to_rgb(hue/8.0, 1, 1)
+    return Color(*[int(round(c * 255.0)) for c in rgb])
+
+
+def plasma_frame(num_pixels, f):
+    return frame_from([plasma_color(i, f) for i in range(num_pixels)])
+
+
+def plasma(num_pixels, color, delay, iterations=1000, reverse=False):
+    def build():
+        for f in range(iterations):
+            yield plasma_frame(num_pixels, f)
+
+    frames = []
+    for frame in cached_cycle(('plasma', num_pixels, iterations), build):
+        frames.append(frame)
+        yield frame
+    for frame in reversed(frames):
+        yield frame
+
+
+# Pure Python frame builders, kept so the NumPy versions can be checked
+# against them with python -m octoprint_rgb_status.benchmark --verify
+PYTHON_FRAME_BUILDERS = {
+    'rainbow': rainbow_frame,
+    'rainbow_cycle': rainbow_cycle_frame,
+    'plasma': plasma_frame,
+}
+
+
+def load_numpy_builders():
+    """Use the NumPy frame builders if NumPy is installed. Importing NumPy
+    takes a while, so only the renderer does it, once it has started.
+    Returns whether NumPy is used."""
+    global rainbow_frame, rainbow_cycle_frame, plasma_frame
+    try:
+        from .numpy_effects import rainbow_frame, rainbow_cycle_frame, plasma_frame
+    except ImportError:
+        return False
+    return True
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Measure how expensive each effect is to render, without LED hardware.
+
+Every effect is rendered through the same path the renderer uses, into an
+in-memory FakeStrip, and the results are printed as JSON:
+
+    python -m octoprint_rgb_status.benchmark --leds 10,60,300,1000 --output bench.json
+
+Each effect is measured twice per LED count: "cold" with an empty frame
+cache and "warm" right after, which is what a looping effect costs once its
+first cycle has been cached.
+
+With --verify, nothing is timed. Instead every NumPy frame builder is
+compared with its pure Python counterpart at several LED counts and steps,
+and the command fails if any frame differs.
+
+With --startup, the time it takes to import the plugin is measured too, in
+fresh interpreters with OctoPrint itself already imported, along with
+whether any of the modules only the renderer needs were imported with it.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from . import EFFECTS
+from .basic_effects import progress_effect, load_numpy_builders, PYTHON_FRAME_BUILDERS
+from .frames import frame_cache, frame_span
+from .metrics import percentile
+from .output import StripOutput
+from .renderer import write_frame
+
+try:
+    from time import perf_counter
+except ImportError:
+    from time import time as perf_counter
+
+DEFAULT_LED_COUNTS = [10, 60, 300, 1000]
+DEFAULT_FRAMES = 300
+DEFAULT_STARTUP_RUNS = 5
+# Steps the frame builders are compared at, 0 to 999 (plasma runs up to
+# 1000 steps) and where the rainbows wrap around
+VERIFY_STEPS = list(range(0, 1000, 37)) + [255, 256]
+# Modules the plugin should leave to the renderer
+RENDERER_MODULES = ['numpy', 'rpi_ws281x', '_rpi_ws281x']
+STARTUP_SCRIPT = """
+import json, sys, time
+for module in ('octoprint.plugin', 'octoprint.printer'):
+    try:
+        __import__(module)
+    except ImportError:
+        pass
+started = time.time()
+import octoprint_rgb_status
+seconds = time.time() - started
+print(json.dumps({'seconds': seconds, 'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+
+class FakeStrip(object):
+    """Stands in for Adafruit_NeoPixel and counts what is done to it."""
+
+    def __init__(self, num_pixels):
+        self.pixels = [0] * num_pixels
+        self.brightness = 255
+        self.show_calls = 0
+        self.pixel_writes = 0
+
+    def begin(self):
+        pass
+
+    def numPixels(self):
+        return len(self.pixels)
+
+    def setPixelColor(self, n, color):
+        self.pixels[n] = color
+        self.pixel_writes += 1
+
+    def setPixelColorRGB(self, n, red, green, blue, white=0):
+        self.setPixelColor(n, (white << 24) | (red << 16) | (green << 8) | blue)
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def __setitem__(self, pos, value):
+        indices = range(*pos.indices(len(self.pixels)))
+        for index, n in enumerate(indices):
+            self.pixels[n] = value[index]
+        self.pixel_writes += len(indices)
+
+    def show(self):
+        self.show_calls += 1
+
+
+def effect_frames(effect, num_pixels, kwargs):
+    """Loop the effect forever, like the renderer does."""
+    while True:
+        empty = True
+        for frame in effect(num_pixels, (255, 0, 0), 0, reverse=False, **kwargs):
+            empty = False
+            yield frame
+        if empty:
+            return
+
+
+def render(effect, num_pixels, frames, kwargs):
+    """Render up to frames frames into a FakeStrip and time each one."""
+    strip = FakeStrip(num_pixels)
+    output = StripOutput(strip)
+    timings = []
+    source = effect_frames(effect, num_pixels, kwargs)
+    for i in range(frames):
+        started = perf_counter()
+        item = next(source, None)
+        if item is None:
+            break
+        frame, start, end = frame_span(item)
+        write_frame(output, frame[start:end], start)
+        timings.append(perf_counter() - started)
+    return strip, timings
+
+
+def measure_time(effect, num_pixels, frames, kwargs):
+    strip, timings = render(effect, num_pixels, frames, kwargs)
+    if not timings:
+        return {'frames': 0}
+    total = sum(timings)
+    return {
+        'frames': len(timings),
+        'mean_ms': total / len(timings) * 1000,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': max(timings) * 1000,
+        'max_fps': len(timings) / total if total else None,
+        'show_calls': strip.show_calls,
+        'pixel_writes': strip.pixel_writes,
+    }
+
+
+def measure_memory(effect, num_pixels, frames, kwargs):
+    """Run again under tracemalloc, which would skew the timings."""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    render(effect, num_pixels, frames, kwargs)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'retained_bytes': current - baseline,
+        'peak_bytes': peak - baseline,
+    }
+
+
+def measure_startup(runs=DEFAULT_STARTUP_RUNS):
+    """Import the plugin in runs fresh interpreters."""
+    timings, loaded = [], set()
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT % (RENDERER_MODULES,)])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        timings.append(result['seconds'])
+        loaded.update(result['loaded'])
+    return {
+        'runs': runs,
+        'import_p50_ms': percentile(timings, 0.5) * 1000,
+        'import_max_ms': max(timings) * 1000,
+        'renderer_modules_loaded': sorted(loaded),
+    }
+
+
+def verify_builders(led_counts, steps=VERIFY_STEPS):
+    """Compare the NumPy frame builders with the pure Python ones. Raises
+    ImportError if NumPy is not installed."""
+    from . import numpy_effects
+    mismatches = []
+    for name, python_builder in sorted(PYTHON_FRAME_BUILDERS.items()):
+        numpy_builder = getattr(numpy_effects, '{}_frame'.format(name))
+        for num_pixels in led_counts:
+            for step in steps:
+                if list(python_builder(num_pixels, step)) != list(numpy_builder(num_pixels, step)):
+                    mismatches.append({'builder': name, 'led_count': num_pixels, 'step': step})
+    return {
+        'builders': sorted(PYTHON_FRAME_BUILDERS),
+        'led_counts': led_counts,
+        'steps': len(steps),
+        'mismatches': mismatches,
+    }
+
+
+def run_benchmarks(led_counts=DEFAULT_LED_COUNTS, frames=DEFAULT_FRAMES, effect_names=None):
+    load_numpy_builders()
+    effects = dict(EFFECTS)
+    effects['Progress'] = progress_effect
+    extra_kwargs = {'Progress': {'progress': 50, 'progress_color': (0, 255, 0)}}
+    results = []
+    for name in sorted(effects):
+        if effect_names and name not in effect_names:
+            continue
+        kwargs = extra_kwargs.get(name, {})
+        for num_pixels in led_counts:
+            runs = {}
+            frame_cache.clear()
+            for phase in ('cold', 'warm'):
+                runs[phase] = measure_time(effects[name], num_pixels, frames, kwargs)
+            frame_cache.clear()
+            for phase in ('cold', 'warm'):
+                runs[phase].update(measure_memory(effects[name], num_pixels, frames, kwargs))
+                runs[phase].update({'effect': name, 'led_count': num_pixels, 'phase': phase})
+                results.append(runs[phase])
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+        'frames_per_run': frames,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark RGB Status effects against a fake strip')
+    parser.add_argument('--leds', default=','.join(str(count) for count in DEFAULT_LED_COUNTS),
+                        help='comma separated LED counts')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames to render per run')
+    parser.add_argument('--effect', action='append', dest='effects', help='only run this effect (repeatable)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--startup', action='store_true', help='also measure how long importing the plugin takes')
+    parser.add_argument('--verify', action='store_true',
+                        help='check that the NumPy frame builders match the pure Python ones instead')
+    args = parser.parse_args(argv)
+    led_counts = [int(count) for count in args.leds.split(',')]
+
+    if args.verify:
+        try:
+            report = verify_builders(led_counts)
+        except ImportError:
+            parser.error('--verify needs NumPy')
+    else:
+        report = run_benchmarks(
+            led_counts=led_counts,
+            frames=args.frames,
+            effect_names=args.effects,
+        )
+    if args.startup:
+        report['startup'] = measure_startup()
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if report.get('mismatches'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
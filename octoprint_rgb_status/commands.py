@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import itertools
+import threading
+from subprocess import Popen, PIPE
+from six.moves.queue import Queue
+
+DEFAULT_TIMEOUT = 30
+# Finished jobs kept around for status requests
+MAX_FINISHED_JOBS = 20
+
+
+def run_command(command, password=None, timeout=DEFAULT_TIMEOUT):
+    """Run command, writing password to its stdin, and kill it after timeout
+    seconds. Returns (returncode, stdout, stderr, timed_out) with the output
+    decoded to text."""
+    if not isinstance(command, list):
+        command = command.split()
+    proc = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    timer.start()
+    try:
+        if password is not None:
+            stdout, stderr = proc.communicate('{}\n'.format(password).encode())
+        else:
+            stdout, stderr = proc.communicate()
+    finally:
+        timer.cancel()
+    return proc.returncode, stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace'), timed_out.is_set()
+
+
+class CommandRunner(object):
+    """Runs commands one after the other on a worker thread, so requests
+    return right away. Every job is a dict which on_update gets called with
+    whenever its state changes: queued, running, then done, failed or
+    timeout."""
+
+    def __init__(self, on_update):
+        self.on_update = on_update
+        self.queue = Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def submit(self, name, command, password=None, timeout=DEFAULT_TIMEOUT):
+        job = {'id': next(self.ids), 'command': name, 'state': 'queued', 'error': None}
+        with self.lock:
+            self.jobs[job['id']] = job
+            finished = [job_id for job_id, other in sorted(self.jobs.items()) if other['state'] not in ('queued', 'running')]
+            for job_id in finished[:-MAX_FINISHED_JOBS]:
+                del self.jobs[job_id]
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.work, name='RGB Status Commands')
+                self.worker.daemon = True
+                self.worker.start()
+        self.queue.put((job, command, password, timeout))
+        self.on_update(dict(job))
+        return job['id']
+
+    def job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def work(self):
+        while True:
+            job, command, password, timeout = self.queue.get()
+            self.update(job, state='running')
+            try:
+                returncode, stdout, stderr, timed_out = run_command(command, password, timeout)
+            except Exception as e:
+                self.update(job, state='failed', error=str(e))
+                continue
+            if timed_out:
+                self.update(job, state='timeout', error='Timed out after {} seconds'.format(timeout))
+            elif 'incorrect password attempt' in stderr:
+                self.update(job, state='failed', error='Incorrect password attempt')
+            elif returncode != 0:
+                self.update(job, state='failed', error=stderr.strip() or 'Exited with code {}'.format(returncode))
+            else:
+                self.update(job, state='done')
+
+    def update(self, job, **changes):
+        with self.lock:
+            job.update(changes)
+            update = dict(job)
+        self.on_update(update)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Effects defined in the settings instead of in code.
+
+Every custom effect is a dict with a name, a type and the options of that
+type. Nothing in it is evaluated as code: the options are checked when the
+effect is compiled, and compiling turns the effect into tables that the
+frames are sliced or looked up from.
+
+gradient   colors blended along the strip. With a period, the gradient
+           scrolls once along the strip every period steps.
+               colors: two or more colors, period: steps (0 stands still)
+keyframes  the whole strip fades from one color to the next and back to
+           the first one.
+               colors: two or more colors, steps: steps per fade,
+               hold: steps to stay at every color
+wave       hue and brightness as functions of pixel and time. The hue runs
+           hue_spread degrees along the strip from hue_start and turns
+           hue_turns times per period. The brightness swings between
+           brightness_min and brightness_max in waves waves along the
+           strip, moving one wave length per period.
+               period, hue_start, hue_spread, hue_turns, brightness_min,
+               brightness_max, waves
+
+Colors are "#rrggbb" strings, either as a list or comma separated.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import colorsys
+import math
+import re
+from six import string_types
+from six.moves import range
+from .basic_effects import scale_color
+from .frames import Color, new_frame, frame_from, cached_cycle
+from .utils import blend_colors, hex_to_rgb
+
+# Longest animation, in steps, a custom effect may have
+MAX_FRAMES = 1024
+COLOR_PATTERN = re.compile(r'^#[0-9a-fA-F]{6}$')
+# Fully saturated color for every whole degree of hue
+HUES = [Color(*[int(round(value * 255)) for value in colorsys.hsv_to_rgb(degree / 360.0, 1, 1)]) for degree in range(360)]
+
+
+def parse_colors(value):
+    if isinstance(value, string_types):
+        value = [color.strip() for color in value.split(',') if color.strip()]
+    if not isinstance(value, (list, tuple)) or len(value) < 2:
+        raise ValueError('needs at least two colors')
+    for color in value:
+        if not isinstance(color, string_types) or not COLOR_PATTERN.match(color):
+            raise ValueError('{!r} is not a #rrggbb color'.format(color))
+    return tuple(hex_to_rgb(color) for color in value)
+
+
+def parse_number(spec, key, default, low, high):
+    value = spec.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('{} must be a number'.format(key))
+    if not low <= value <= high:
+        raise ValueError('{} must be between {} and {}'.format(key, low, high))
+    return value
+
+
+class CustomEffect(object):
+    """A compiled custom effect. Called like the effects in basic_effects.
+    It only holds plain values, so it can be sent to the renderer.
+    Gradients and keyframes are seekable (see basic_effects.seekable),
+    waves replay a cached cycle."""
+
+    def __init__(self, name, kind, options):
+        self.name = self.__name__ = name
+        self.kind = kind
+        self.options = options
+        self.key = ('custom', kind, tuple(sorted(options.items())))
+        self.static = kind == 'gradient' and not options['period']
+        self.seekable = kind in ('gradient', 'keyframes')
+        self.colors = self.keyframe_colors() if kind == 'keyframes' else None
+
+    def __eq__(self, other):
+        return isinstance(other, CustomEffect) and (self.name, self.key) == (other.name, other.key)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.name, self.key))
+
+    def __call__(self, num_pixels, color, delay=0, iterations=1, reverse=False, step=0):
+        if self.seekable:
+            return getattr(self, self.kind)(num_pixels, reverse, step)
+        return getattr(self, self.kind)(num_pixels, reverse)
+
+    def gradient(self, num_pixels, reverse, first=0):
+        colors, period = self.options['colors'], self.options['period']
+        if period:
+            # Scrolling wraps around, so end on the first color again
+            colors = colors + colors[:1]
+        base = []
+        for i in range(num_pixels):
+            position = i * (len(colors) - 1) / float(max(num_pixels - (0 if period else 1), 1))
+            stop = min(int(position), len(colors) - 2)
+            base.append(Color(*blend_colors(colors[stop], colors[stop + 1], position - stop)))
+        base = frame_from(base)
+        if reverse:
+            base.reverse()
+        if not period:
+            yield base
+            return
+        for step in range(first % period, period):
+            offset = step * num_pixels // period
+            if not reverse:
+                offset = (num_pixels - offset) % num_pixels
+            yield base[offset:] + base[:offset]
+
+    def keyframe_colors(self):
+        colors, steps, hold = self.options['colors'], self.options['steps'], self.options['hold']
+        table = []
+        for index, color in enumerate(colors):
+            following = colors[(index + 1) % len(colors)]
+            table.extend([Color(*color)] * hold)
+            table.extend(Color(*blend_colors(color, following, step / float(steps))) for step in range(steps))
+        return table
+
+    def keyframes(self, num_pixels, reverse, first=0):
+        for color in self.colors[first % len(self.colors):]:
+            yield new_frame(num_pixels, color)
+
+    def wave(self, num_pixels, reverse):
+        options = self.options
+        period = options['period']
+        low, high = options['brightness_min'], options['brightness_max']
+        spread = options['hue_spread'] / float(max(num_pixels, 1))
+        waves = 2 * math.pi * options['waves'] / float(max(num_pixels, 1))
+        pixels = list(range(num_pixels))
+        if reverse:
+            pixels.reverse()
+
+        def build():
+            for step in range(period):
+                phase = step / float(period)
+                hue = options['hue_start'] + 360 * options['hue_turns'] * phase
+                shift = 2 * math.pi * phase
+                yield frame_from([
+                    scale_color(
+                        HUES[int(hue + spread * i) % 360],
+                        int(low + (high - low) * (0.5 + 0.5 * math.cos(waves * i - shift))),
+                    )
+                    for i in pixels
+                ])
+
+        for frame in cached_cycle(self.key + (num_pixels, reverse), build):
+            yield frame
+
+
+def compile_effect(spec):
+    """Check a custom effect spec and compile it. Raises ValueError with a
+    message meant for the user if the spec is not valid."""
+    if not isinstance(spec, dict):
+        raise ValueError('is not a mapping')
+    kind = spec.get('type')
+    if kind == 'gradient':
+        options = {
+            'colors': parse_colors(spec.get('colors')),
+            'period': parse_number(spec, 'period', 0, 0, MAX_FRAMES),
+        }
+    elif kind == 'keyframes':
+        options = {
+            'colors': parse_colors(spec.get('colors')),
+            'steps': parse_number(spec, 'steps', 50, 1, MAX_FRAMES),
+            'hold': parse_number(spec, 'hold', 0, 0, MAX_FRAMES),
+        }
+        if len(options['colors']) * (options['steps'] + options['hold']) > MAX_FRAMES:
+            raise ValueError('has more than {} steps'.format(MAX_FRAMES))
+    elif kind == 'wave':
+        options = {
+            'period': parse_number(spec, 'period', 100, 1, MAX_FRAMES),
+            'hue_start': parse_number(spec, 'hue_start', 0, 0, 360),
+            'hue_spread': parse_number(spec, 'hue_spread', 0, -3600, 3600),
+            'hue_turns': parse_number(spec, 'hue_turns', 0, -100, 100),
+            'brightness_min': parse_number(spec, 'brightness_min', 255, 0, 255),
+            'brightness_max': parse_number(spec, 'brightness_max', 255, 0, 255),
+            'waves': parse_number(spec, 'waves', 0, 0, 1000),
+        }
+    else:
+        raise ValueError('has unknown type {!r}'.format(kind))
+    return CustomEffect(spec.get('name'), kind, options)
+
+
+def compile_effects(specs, reserved=()):
+    """Compile the custom effects in the settings. Returns the effects by
+    name and a message for every effect that was left out."""
+    effects, errors = {}, []
+    for spec in specs or []:
+        name = spec.get('name') if isinstance(spec, dict) else None
+        if not name or not isinstance(name, string_types):
+            errors.append('A custom effect has no name')
+            continue
+        if name in reserved or name in effects:
+            errors.append('The custom effect {} has the name of another effect'.format(name))
+            continue
+        try:
+            effects[name] = compile_effect(spec)
+        except ValueError as e:
+            errors.append('The custom effect {} {}'.format(name, e))
+    return effects, errors
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import struct
+import sys
+import threading
+from array import array
+from .frames import FRAME_TYPECODE
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Pixels beyond this are dropped
+MAX_PIXELS = 4096
+# written sequence, consumed sequence, pixel count
+HEADER = struct.Struct(str('<III'))
+READ_ATTEMPTS = 100
+
+
+class FrameBuffer(object):
+    """A frame of packed colors shared between the plugin and the renderer.
+
+    The plugin writes frames and the renderer reads them, so only a short
+    notification has to go through the control queue. The sequence number
+    is odd while a frame is being written; the renderer copies a frame
+    again if the number changed while it was copying. write() tells
+    whether the renderer still needs to be notified: while it has not
+    read the frame it was last notified about, it will read the newest
+    frame anyway, so fast producers do not fill the queue.
+
+    Uses multiprocessing.shared_memory where available. Otherwise it falls
+    back to a RawArray, which has to be handed to the renderer when it is
+    started.
+    """
+
+    def __init__(self, context, max_pixels=MAX_PIXELS):
+        size = HEADER.size + max_pixels * 4
+        self.max_pixels = max_pixels
+        if shared_memory is not None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = context.RawArray('B', size)
+        self.lock = threading.Lock()
+        self.notified = 0
+
+    def __getstate__(self):
+        return {'memory': self.memory, 'max_pixels': self.max_pixels}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = None
+        self.notified = 0
+
+    @property
+    def buf(self):
+        if shared_memory is not None:
+            return self.memory.buf
+        view = memoryview(self.memory)
+        return view.cast('B') if hasattr(view, 'cast') else view
+
+    def header(self):
+        return HEADER.unpack_from(self.buf, 0)
+
+    def write_rgb(self, rgb):
+        """Write a frame given as three bytes (red, green, blue) per pixel.
+        Returns True if the renderer has to be notified."""
+        count = min(len(rgb) // 3, self.max_pixels)
+        rgb = bytearray(rgb[:count * 3])
+        data = bytearray(count * 4)
+        data[0::4] = rgb[2::3]
+        data[1::4] = rgb[1::3]
+        data[2::4] = rgb[0::3]
+        with self.lock:
+            buf = self.buf
+            written, consumed, old_count = self.header()
+            struct.pack_into(str('<I'), buf, 0, written + 1)
+            buf[HEADER.size:HEADER.size + len(data)] = bytes(data)
+            struct.pack_into(str('<I'), buf, 8, count)
+            struct.pack_into(str('<I'), buf, 0, written + 2)
+            notify = consumed >= self.notified
+            if notify:
+                self.notified = written + 2
+            return notify
+
+    def forget_notifications(self):
+        """The renderer that was notified last is gone, so the next frame
+        has to notify the new one."""
+        with self.lock:
+            self.notified = 0
+
+    def read(self, num_pixels):
+        """The latest frame, padded or cut to num_pixels, or None if it could
+        not be read consistently."""
+        buf = self.buf
+        for attempt in range(READ_ATTEMPTS):
+            written, consumed, count = self.header()
+            if written % 2:
+                continue
+            data = bytes(buf[HEADER.size:HEADER.size + min(count, num_pixels) * 4])
+            if self.header()[0] != written:
+                continue
+            struct.pack_into(str('<I'), buf, 4, written)
+            if self.header()[0] != written:
+                # A frame came in before it was marked as read, and its
+                # writer did not notify: read that one too.
+                continue
+            frame = array(FRAME_TYPECODE)
+            if hasattr(frame, 'frombytes'):
+                frame.frombytes(data)
+            else:
+                frame.fromstring(data)
+            if sys.byteorder != 'little':
+                frame.byteswap()
+            if len(frame) < num_pixels:
+                frame.extend([0] * (num_pixels - len(frame)))
+            return frame
+        return None
+
+    def close(self):
+        if shared_memory is not None:
+            self.memory.close()
+
+    def unlink(self):
+        if shared_memory is not None:
+            self.memory.unlink()
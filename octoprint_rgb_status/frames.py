@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from array import array
+from collections import OrderedDict
+
+# A frame is a flat array of 32 bit colors, one per pixel, packed the same
+# way as rpi_ws281x.Color so it can be handed to the strip as-is.
+FRAME_TYPECODE = 'I'
+
+# Upper bound on the number of pixels kept in the frame cache (4 bytes each).
+CACHE_MAX_PIXELS = 2 * 1024 * 1024
+
+
+def Color(red, green, blue, white=0):
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+
+def color_to_rgb(color):
+    return ((color >> 16) & 255, (color >> 8) & 255, color & 255)
+
+
+def new_frame(num_pixels, color=0):
+    return array(FRAME_TYPECODE, [color]) * num_pixels
+
+
+def frame_from(colors):
+    return array(FRAME_TYPECODE, colors)
+
+
+def frame_span(item):
+    """Effects yield either a frame or a (frame, start, end) tuple when only
+    part of the frame changed. Return it as the latter."""
+    if isinstance(item, tuple):
+        return item
+    return item, 0, len(item)
+
+
+def frame_from_bytes(data):
+    frame = array(FRAME_TYPECODE)
+    if hasattr(frame, 'frombytes'):
+        frame.frombytes(data)
+    else:
+        frame.fromstring(data)
+    return frame
+
+
+class FrameCache(object):
+    """LRU cache of whole effect cycles, bounded by the total pixel count."""
+
+    def __init__(self, max_pixels=CACHE_MAX_PIXELS):
+        self.max_pixels = max_pixels
+        self.pixels = 0
+        self._cycles = OrderedDict()
+
+    def get(self, key):
+        frames = self._cycles.pop(key, None)
+        if frames is not None:
+            self._cycles[key] = frames
+        return frames
+
+    def put(self, key, frames):
+        size = sum(len(frame) for frame in frames)
+        if size > self.max_pixels:
+            return
+        if key in self._cycles:
+            self.pixels -= sum(len(frame) for frame in self._cycles.pop(key))
+        while self._cycles and self.pixels + size > self.max_pixels:
+            self.pixels -= sum(len(frame) for frame in self._cycles.popitem(last=False)[1])
+        self._cycles[key] = frames
+        self.pixels += size
+
+    def clear(self):
+        self._cycles.clear()
+        self.pixels = 0
+
+
+frame_cache = FrameCache()
+
+
+def cached_cycle(key, build):
+    """Yield the frames of one effect cycle, building them with build() the
+    first time and replaying them from the cache afterwards. A cycle that is
+    interrupted before it completes is not cached."""
+    frames = frame_cache.get(key)
+    if frames is None:
+        frames = []
+        for frame in build():
+            frames.append(frame)
+            yield frame
+        frame_cache.put(key, frames)
+    else:
+        for frame in frames:
+            yield frame
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# A heater counts as heating up once its target is at least MIN_RISE degrees
+# above its temperature, and as done once it is within TOLERANCE of it.
+MIN_RISE = 10.0
+TOLERANCE = 2.0
+
+
+class HeatingMonitor(object):
+    """Follows OctoPrint's temperature reports and tells how far the heaters
+    are from their targets, as a percentage measured from the temperature
+    each heater was at when its target was set."""
+
+    def __init__(self, min_rise=MIN_RISE, tolerance=TOLERANCE):
+        self.min_rise = min_rise
+        self.tolerance = tolerance
+        # heater name: (start temperature, target)
+        self.heaters = {}
+
+    def update(self, data):
+        """Take one temperature report and return the progress of the
+        slowest heater, or None when nothing is heating up."""
+        progress = None
+        for name, values in data.items():
+            if not isinstance(values, dict):
+                continue
+            actual, target = values.get('actual'), values.get('target')
+            if actual is None or not target or actual >= target - self.tolerance:
+                self.heaters.pop(name, None)
+                continue
+            start, old_target = self.heaters.get(name, (None, None))
+            if target != old_target:
+                if target - actual < self.min_rise:
+                    self.heaters.pop(name, None)
+                    continue
+                start = actual
+                self.heaters[name] = (start, target)
+            heater_progress = min(max((actual - start) / (target - start) * 100, 0), 100)
+            if progress is None or heater_progress < progress:
+                progress = heater_progress
+        return progress
+
+    def reset(self):
+        self.heaters.clear()
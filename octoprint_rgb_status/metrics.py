@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import deque
+from .timing import monotonic
+
+# Seconds between two reports from the renderer
+REPORT_INTERVAL = 5.0
+# Render and show times kept per effect for the percentiles
+SAMPLES = 512
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class EffectMetrics(object):
+    """What rendering one effect has cost so far."""
+
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.window_frames = 0
+        self.render_times = deque(maxlen=SAMPLES)
+        self.show_times = deque(maxlen=SAMPLES)
+
+    def report(self, window):
+        report = {
+            'frames': self.frames,
+            'dropped_frames': self.dropped,
+            'fps': self.window_frames / window if window > 0 else 0,
+        }
+        for name, times in (('render', self.render_times), ('show', self.show_times)):
+            if times:
+                report['{}_p50_ms'.format(name)] = percentile(times, 0.5) * 1000
+                report['{}_p99_ms'.format(name)] = percentile(times, 0.99) * 1000
+        self.window_frames = 0
+        return report
+
+
+class RenderMetrics(object):
+    """Collects render metrics per effect inside the renderer and turns them
+    into a report every interval seconds. Nothing is reported while nothing
+    happens, the next window starts with the next frame or message."""
+
+    def __init__(self, interval=REPORT_INTERVAL, now=None):
+        self.interval = interval
+        self.effects = {}
+        self.effect = None
+        self.current = None
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.window_started = monotonic() if now is None else now
+        self.active = False
+
+    def start_effect(self, name):
+        self.effect = name
+        self.current = self.effects.get(name)
+        if self.current is None:
+            self.current = self.effects[name] = EffectMetrics()
+
+    def rendered(self, seconds, dropped):
+        if self.current is not None:
+            self.current.render_times.append(seconds)
+            self.current.dropped += dropped
+            self.activity()
+
+    def shown(self, seconds):
+        if self.current is not None:
+            self.current.show_times.append(seconds)
+            self.current.frames += 1
+            self.current.window_frames += 1
+            self.activity()
+
+    def received(self, depth):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self.activity()
+
+    def activity(self):
+        if not self.active:
+            self.active = True
+            self.window_started = monotonic()
+
+    def next_report(self):
+        return self.window_started + self.interval if self.active else None
+
+    def report(self, now=None):
+        now = monotonic() if now is None else now
+        window = now - self.window_started
+        report = {
+            'effect': self.effect,
+            'window': window,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'effects': dict((name, effect.report(window)) for name, effect in self.effects.items()),
+        }
+        self.window_started = now
+        self.active = False
+        return report
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""NumPy versions of the expensive frame builders in basic_effects.
+
+Importing this module raises ImportError when NumPy is not installed, in
+which case basic_effects keeps using its pure Python builders. Every
+builder here produces exactly the same pixels as its pure Python
+counterpart, which python -m octoprint_rgb_status.benchmark --verify
+checks.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import numpy
+from .frames import frame_from_bytes
+
+
+def _wheel_table():
+    pos = numpy.arange(256, dtype=numpy.uint32)
+    red = numpy.where(pos < 85, pos * 3, numpy.where(pos < 170, 255 - (pos - 85) * 3, 0))
+    green = numpy.where(pos < 85, 255 - pos * 3, numpy.where(pos < 170, 0, (pos - 170) * 3))
+    blue = numpy.where(pos < 85, 0, numpy.where(pos < 170, (pos - 85) * 3, 255 - (pos - 170) * 3))
+    return pack(red, green, blue)
+
+
+def pack(red, green, blue):
+    return (red.astype(numpy.uint32) << 16) | (green.astype(numpy.uint32) << 8) | blue.astype(numpy.uint32)
+
+
+def to_frame(colors):
+    return frame_from_bytes(colors.astype(numpy.uint32).tobytes())
+
+
+WHEEL = _wheel_table()
+
+
+def rainbow_frame(num_pixels, i):
+    return to_frame(WHEEL[(numpy.arange(num_pixels) + i) & 255])
+
+
+def rainbow_cycle_frame(num_pixels, i):
+    offsets = (numpy.arange(num_pixels) * 256 / num_pixels).astype(numpy.int64)
+    return to_frame(WHEEL[(offsets + i) & 255])
+
+
+# Pixels whose hue lands this close to a sector edge, or whose channels land
+# this close to a rounding tie, are recomputed with math.sin so that the
+# last-bit differences between numpy.sin and math.sin cannot change a color.
+_EPSILON = 1e-9
+
+
+def plasma_frame(num_pixels, f):
+    i = numpy.arange(num_pixels, dtype=numpy.float64)
+    x = f + i
+    hue = 4.0 + numpy.sin(x / 19.0) + numpy.sin(i / 9.0) + numpy.sin((x + i) / 25.0) + numpy.sin(numpy.sqrt(x * x + i * i) / 8.0)
+
+    # colorsys.hsv_to_rgb(hue/8.0, 1, 1), step for step
+    h6 = (hue / 8.0) * 6.0
+    sector = h6.astype(numpy.int64)
+    frac = h6 - sector
+    q = 1.0 - frac
+    t = 1.0 - (1.0 - frac)
+    sector %= 6
+    one = numpy.ones(num_pixels)
+    zero = numpy.zeros(num_pixels)
+    red = numpy.select([sector == 0, sector == 1, sector == 4, sector == 5], [one, q, t, one], zero)
+    green = numpy.select([sector == 0, sector == 1, sector == 2, sector == 3], [t, one, one, q], zero)
+    blue = numpy.select([sector == 2, sector == 3, sector == 4, sector == 5], [t, one, one, q], zero)
+
+    channels = numpy.stack([red, green, blue]) * 255.0
+    rounded = numpy.rint(channels)
+    colors = pack(rounded[0], rounded[1], rounded[2])
+
+    unsure = numpy.abs(h6 - numpy.rint(h6)) < _EPSILON
+    unsure |= (numpy.abs(numpy.abs(channels - numpy.floor(channels)) - 0.5) < _EPSILON).any(axis=0)
+    frame = to_frame(colors)
+    if unsure.any():
+        from .basic_effects import plasma_color
+        for p in numpy.flatnonzero(unsure):
+            frame[p] = plasma_color(int(p), f)
+    return frame
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""Output backends the renderer pushes its frames to.
+
+A backend has a num_pixels attribute and three methods:
+
+    write(pixels, start)  copy packed 0xWWRRGGBB colors to the pixels from
+                          start on, without showing them yet
+    show()                make everything written so far visible at once
+    close()               release the hardware, socket or file
+
+A backend may also set discards_frames, in which case the renderer does
+not render any frames for it at all.
+
+open_output() builds the backend described by an output config, a dict
+whose 'backend' key is one of OUTPUT_BACKENDS. The rpi_ws281x driver is only
+imported once a neopixel output is opened, so everything else works on
+hosts without it.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import socket
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from six.moves import range
+from .frames import FRAME_TYPECODE
+from .timing import monotonic
+
+# DDP (Distributed Display Protocol), as spoken by WLED and most ESP32 pixel
+# controllers: a 10 byte header followed by up to 480 RGB pixels.
+DDP_PORT = 4048
+DDP_HEADER = struct.Struct(str('!BBBBIH'))
+DDP_VERSION_1 = 0x40
+DDP_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_DESTINATION = 0x01
+DDP_MAX_DATA = 1440
+
+# Recordings start with RECORDING_MAGIC, a format version and the pixel
+# count. Then follow write records, the type byte, the first pixel and the
+# pixel count followed by the colors as little endian 32 bit integers, and
+# show records, the type byte and the seconds since the recording started.
+RECORDING_MAGIC = b'RGBS'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct(str('<4sBI'))
+RECORD_TYPE = struct.Struct(str('<B'))
+RECORD_WRITE = 1
+RECORD_SHOW = 2
+WRITE_RECORD = struct.Struct(str('<II'))
+SHOW_RECORD = struct.Struct(str('<d'))
+RECORDING_MAX_BYTES = 64 * 1024 * 1024
+
+# The LED types rpi_ws281x knows, by the names its constants have
+STRIP_TYPES = [
+    'SK6812_STRIP_RGBW',
+    'SK6812_STRIP_RBGW',
+    'SK6812_STRIP_GRBW',
+    'SK6812_STRIP_GBRW',
+    'SK6812_STRIP_BRGW',
+    'SK6812_STRIP_BGRW',
+    'SK6812_SHIFT_WMASK',
+    'WS2811_STRIP_RGB',
+    'WS2811_STRIP_RBG',
+    'WS2811_STRIP_GRB',
+    'WS2811_STRIP_GBR',
+    'WS2811_STRIP_BRG',
+    'WS2811_STRIP_BGR',
+    'WS2812_STRIP',
+    'SK6812_STRIP',
+    'SK6812W_STRIP',
+]
+
+
+def packed_bytes(pixels, byteorder='little'):
+    """The colors as 32 bit integers in the given byte order."""
+    raw = array(FRAME_TYPECODE, pixels)
+    if sys.byteorder != byteorder:
+        raw.byteswap()
+    return raw.tobytes() if hasattr(raw, 'tobytes') else raw.tostring()
+
+
+def strip_type_value(rpi_ws281x, name):
+    """The rpi_ws281x constant for an LED type from STRIP_TYPES."""
+    if name not in STRIP_TYPES:
+        raise ValueError('Unknown LED type {}'.format(name))
+    return getattr(rpi_ws281x, name)
+
+
+def rgb_bytes(pixels):
+    """The colors as three bytes each, red, green and blue."""
+    raw = bytearray(packed_bytes(pixels))
+    rgb = bytearray(len(pixels) * 3)
+    rgb[0::3] = raw[2::4]
+    rgb[1::3] = raw[1::4]
+    rgb[2::3] = raw[0::4]
+    return rgb
+
+
+class StripOutput(object):
+    """Output to a single Adafruit_NeoPixel compatible strip object. Given
+    the driver's ws module, close() also stops the driver, which
+    Adafruit_NeoPixel itself never does."""
+
+    def __init__(self, strip, ws=None):
+        self.strip = strip
+        self.ws = ws
+        self.num_pixels = strip.numPixels()
+
+    def write(self, pixels, start=0):
+        self.strip[start:start + len(pixels)] = pixels
+
+    def show(self):
+        self.strip.show()
+
+    def close(self):
+        leds = getattr(self.strip, '_leds', None)
+        if self.ws is not None and leds is not None:
+            # Stops the DMA and frees its memory, _cleanup() only deletes
+            # the struct
+            self.ws.ws2811_fini(leds)
+        cleanup = getattr(self.strip, '_cleanup', None)
+        if cleanup is not None:
+            cleanup()
+
+
+class NeoPixelDevice(object):
+    """One ws281x device: a DMA channel driving one or both PWM channels.
+
+    This does what Adafruit_NeoPixel does for a single channel, but sets up
+    every configured channel so both are rendered by one ws2811_render().
+    """
+
+    def __init__(self, ws, configs):
+        self.ws = ws
+        self.leds = ws.new_ws2811_t()
+        try:
+            self.setup(configs)
+        except Exception:
+            ws.delete_ws2811_t(self.leds)
+            raise
+
+    def setup(self, configs):
+        ws = self.ws
+        for channum in range(2):
+            channel = ws.ws2811_channel_get(self.leds, channum)
+            ws.ws2811_channel_t_count_set(channel, 0)
+            ws.ws2811_channel_t_gpionum_set(channel, 0)
+            ws.ws2811_channel_t_invert_set(channel, 0)
+            ws.ws2811_channel_t_brightness_set(channel, 0)
+        self.channels = []
+        for config in configs:
+            channel = ws.ws2811_channel_get(self.leds, config['led_channel'])
+            ws.ws2811_channel_t_count_set(channel, config['led_count'])
+            ws.ws2811_channel_t_gpionum_set(channel, config['led_pin'])
+            ws.ws2811_channel_t_invert_set(channel, 1 if config['led_invert'] else 0)
+            ws.ws2811_channel_t_brightness_set(channel, config['led_brightness'])
+            ws.ws2811_channel_t_strip_type_set(channel, config['strip_type_value'])
+            self.channels.append((channel, config['led_count']))
+        ws.ws2811_t_freq_set(self.leds, configs[0]['led_freq_hz'])
+        ws.ws2811_t_dmanum_set(self.leds, configs[0]['led_dma'])
+        response = ws.ws2811_init(self.leds)
+        if response != ws.WS2811_SUCCESS:
+            message = ws.ws2811_get_return_t_str(response)
+            raise RuntimeError('ws2811_init failed with code {0} ({1})'.format(response, message))
+
+    def show(self):
+        response = self.ws.ws2811_render(self.leds)
+        if response != self.ws.WS2811_SUCCESS:
+            message = self.ws.ws2811_get_return_t_str(response)
+            raise RuntimeError('ws2811_render failed with code {0} ({1})'.format(response, message))
+
+    def close(self):
+        self.ws.ws2811_fini(self.leds)
+        self.ws.delete_ws2811_t(self.leds)
+
+
+class NeoPixelOutput(object):
+    """Drives several strips as one: pixels are numbered across the strips in
+    the order they are configured. Strips sharing a DMA channel (one per PWM
+    channel) are set up on the same device, strips on other DMA channels,
+    such as an SPI strip, get a device of their own. show() renders every
+    device once.
+    """
+
+    def __init__(self, ws, configs):
+        self.ws = ws
+        groups = OrderedDict()
+        for config in configs:
+            group = groups.setdefault((config['led_dma'], config['led_freq_hz']), [])
+            if any(other['led_channel'] == config['led_channel'] for other in group):
+                raise ValueError('Two strips use channel {0} on DMA {1}'.format(config['led_channel'], config['led_dma']))
+            group.append(config)
+        self.devices = []
+        channels = {}
+        try:
+            for group in groups.values():
+                device = NeoPixelDevice(ws, group)
+                self.devices.append(device)
+                for config, channel in zip(group, device.channels):
+                    channels[id(config)] = channel
+        except Exception:
+            self.close()
+            raise
+        # (first pixel, channel, pixel count) in configuration order
+        self.spans = []
+        self.num_pixels = 0
+        for config in configs:
+            channel, count = channels[id(config)]
+            self.spans.append((self.num_pixels, channel, count))
+            self.num_pixels += count
+
+    def write(self, pixels, start=0):
+        end = start + len(pixels)
+        led_set = self.ws.ws2811_led_set
+        for first, channel, count in self.spans:
+            low, high = max(start, first), min(end, first + count)
+            for n in range(low, high):
+                led_set(channel, n - first, pixels[n - start])
+
+    def show(self):
+        for device in self.devices:
+            device.show()
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        self.devices = []
+
+
+class DDPOutput(object):
+    """Sends frames over UDP to a DDP controller. show() sends the whole
+    frame in as few packets as possible, setting the push flag on the last
+    one so the controller displays the frame at once. The host name is
+    resolved and the socket and the buffers are set up once, then reused
+    for every frame."""
+
+    def __init__(self, host, port=DDP_PORT, led_count=0):
+        family, socktype, proto, canonname, self.address = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0]
+        self.num_pixels = led_count
+        self.data = bytearray(led_count * 3)
+        self.packet = bytearray(DDP_HEADER.size + DDP_MAX_DATA)
+        self.sequence = 0
+        self.socket = socket.socket(family, socktype, proto)
+
+    def write(self, pixels, start=0):
+        self.data[start * 3:(start + len(pixels)) * 3] = rgb_bytes(pixels)
+
+    def show(self):
+        # Sequence numbers 1-15, 0 means the receiver should not check them
+        self.sequence = self.sequence % 15 + 1
+        packet = memoryview(self.packet)
+        data = memoryview(self.data)
+        total = len(self.data)
+        for offset in range(0, total, DDP_MAX_DATA):
+            length = min(DDP_MAX_DATA, total - offset)
+            flags = DDP_VERSION_1 | (DDP_PUSH if offset + length == total else 0)
+            DDP_HEADER.pack_into(self.packet, 0, flags, self.sequence, DDP_TYPE_RGB24, DDP_DESTINATION, offset, length)
+            packet[DDP_HEADER.size:DDP_HEADER.size + length] = data[offset:offset + length]
+            self.socket.sendto(packet[:DDP_HEADER.size + length], self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+class NullOutput(object):
+    """Drops every frame, for hosts without any LEDs. Nothing is rendered
+    for it, so the renderer only wakes up for messages."""
+
+    discards_frames = True
+
+    def __init__(self, led_count=0):
+        self.num_pixels = led_count
+
+    def write(self, pixels, start=0):
+        pass
+
+    def show(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingOutput(object):
+    """Writes every frame to a file instead of a strip, to profile or
+    replay exactly what was rendered with read_recording(). Only the
+    pixels written for a frame are recorded, and recording stops once the
+    file reaches max_bytes."""
+
+    def __init__(self, path, led_count=0, max_bytes=RECORDING_MAX_BYTES):
+        self.num_pixels = led_count
+        self.max_bytes = max_bytes
+        self.file = open(path, 'wb')
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, led_count))
+        self.size = RECORDING_HEADER.size
+        self.started = monotonic()
+
+    def record(self, *chunks):
+        size = sum(len(chunk) for chunk in chunks)
+        if self.size + size <= self.max_bytes:
+            for chunk in chunks:
+                self.file.write(chunk)
+            self.size += size
+
+    def write(self, pixels, start=0):
+        self.record(
+            RECORD_TYPE.pack(RECORD_WRITE),
+            WRITE_RECORD.pack(start, len(pixels)),
+            packed_bytes(pixels),
+        )
+
+    def show(self):
+        self.record(RECORD_TYPE.pack(RECORD_SHOW), SHOW_RECORD.pack(monotonic() - self.started))
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    """Replay a recording, yielding (seconds, frame) for every frame shown.
+    The same frame object is updated and yielded every time."""
+    with open(path, 'rb') as file:
+        magic, version, num_pixels = RECORDING_HEADER.unpack(file.read(RECORDING_HEADER.size))
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+            raise ValueError('{} is not a recording'.format(path))
+        frame = array(FRAME_TYPECODE, [0] * num_pixels)
+        while True:
+            record_type = file.read(RECORD_TYPE.size)
+            if len(record_type) < RECORD_TYPE.size:
+                return
+            record_type = RECORD_TYPE.unpack(record_type)[0]
+            if record_type == RECORD_WRITE:
+                start, count = WRITE_RECORD.unpack(file.read(WRITE_RECORD.size))
+                pixels = array(FRAME_TYPECODE)
+                data = file.read(count * pixels.itemsize)
+                if hasattr(pixels, 'frombytes'):
+                    pixels.frombytes(data)
+                else:
+                    pixels.fromstring(data)
+                if sys.byteorder != 'little':
+                    pixels.byteswap()
+                frame[start:start + count] = pixels
+            elif record_type == RECORD_SHOW:
+                yield SHOW_RECORD.unpack(file.read(SHOW_RECORD.size))[0], frame
+            else:
+                raise ValueError('Unknown record type {} in {}'.format(record_type, path))
+
+
+def open_neopixel(config):
+    """Open the strips in config['strips'], a list of dicts with the
+    STRIP_SETTINGS keys. A single strip goes through Adafruit_NeoPixel."""
+    import rpi_ws281x
+    configs = []
+    for strip in config['strips']:
+        strip = dict(strip)
+        strip['strip_type_value'] = strip_type_value(rpi_ws281x, strip['strip_type'])
+        configs.append(strip)
+    if len(configs) == 1:
+        config = configs[0]
+        strip = rpi_ws281x.Adafruit_NeoPixel(
+            config['led_count'], config['led_pin'], config['led_freq_hz'], config['led_dma'],
+            config['led_invert'], config['led_brightness'], config['led_channel'], config['strip_type_value'])
+        strip.begin()
+        return StripOutput(strip, rpi_ws281x.ws)
+    return NeoPixelOutput(rpi_ws281x.ws, configs)
+
+
+def open_ddp(config):
+    return DDPOutput(config['host'], config['port'], config['led_count'])
+
+
+def open_null(config):
+    return NullOutput(config['led_count'])
+
+
+def open_recording(config):
+    return RecordingOutput(config['path'], config['led_count'])
+
+
+OUTPUT_BACKENDS = {
+    'neopixel': open_neopixel,
+    'ddp': open_ddp,
+    'null': open_null,
+    'recording': open_recording,
+}
+
+
+def open_output(config):
+    backend = OUTPUT_BACKENDS.get(config['backend'])
+    if backend is None:
+        raise ValueError('Unknown output backend {}'.format(config['backend']))
+    return backend(config)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+from .utils import hex_to_rgb
+
+EFFECT_STATES = ['init', 'idle', 'pause', 'fail', 'done', 'disconnected']
+
+# Bounds for the numbers the renderer gets from the settings. A cleared
+# field comes back as None and is replaced by the default.
+DEFAULT_FPS = 50
+MAX_FPS = 240
+DEFAULT_DELAY = 50
+MAX_DELAY = 60000
+MAX_MIN_TIME = 3600
+MIN_GAMMA = 0.1
+MAX_GAMMA = 5.0
+DEFAULT_TRANSITION = 500
+MAX_TRANSITION = 60000
+
+# Everything needed to start the effect for one printer state, parsed from
+# the settings once. kwargs is a tuple of (name, value) pairs so the profile
+# stays immutable.
+EffectProfile = namedtuple('EffectProfile', ['effect_name', 'color', 'delay', 'min_time', 'kwargs'])
+
+# A fixed pixel range running its own effect on top of the status effect
+SegmentProfile = namedtuple('SegmentProfile', ['name', 'start', 'end', 'effect_name', 'color', 'delay'])
+
+# Settings consulted on every event or progress update
+RuntimeOptions = namedtuple('RuntimeOptions', ['led_count', 'leds_reversed', 'show_progress', 'show_heating'])
+
+
+def bounded(value, default, low, high):
+    """value limited to low..high, or default if it is missing."""
+    if value is None:
+        return default
+    return min(max(value, low), high)
+
+
+def build_profiles(settings):
+    profiles = {}
+    for state in EFFECT_STATES:
+        profiles[state] = EffectProfile(
+            effect_name=settings.get(['{}_effect'.format(state)]),
+            color=hex_to_rgb(settings.get(['{}_effect_color'.format(state)])),
+            delay=bounded(settings.get_int(['{}_effect_delay'.format(state)]), DEFAULT_DELAY, 0, MAX_DELAY),
+            min_time=bounded(settings.get_int(['init_effect_min_time']), 0, 0, MAX_MIN_TIME) if state == 'init' else 0,
+            kwargs=(),
+        )
+    profiles['progress'] = EffectProfile(
+        effect_name='Progress',
+        color=hex_to_rgb(settings.get(['progress_base_color'])),
+        delay=50,
+        min_time=0,
+        kwargs=(('progress_color', hex_to_rgb(settings.get(['progress_color']))),),
+    )
+    profiles['heating'] = EffectProfile(
+        effect_name='Heating',
+        color=hex_to_rgb(settings.get(['heating_base_color'])),
+        delay=50,
+        min_time=0,
+        kwargs=(('progress_color', hex_to_rgb(settings.get(['heating_color']))),),
+    )
+    return profiles
+
+
+def build_options(settings, led_count):
+    return RuntimeOptions(
+        led_count=led_count,
+        leds_reversed=settings.get_boolean(['leds_reversed']),
+        show_progress=settings.get_boolean(['show_progress']),
+        show_heating=settings.get_boolean(['show_heating']),
+    )
+
+
+def build_segments(settings):
+    segments = []
+    for segment in settings.get(['segments']) or []:
+        try:
+            start = int(segment.get('start') or 0)
+            count = int(segment.get('count') or 0)
+            delay = int(segment.get('delay') or 0)
+        except (TypeError, ValueError):
+            continue
+        if count <= 0 or start < 0:
+            continue
+        segments.append(SegmentProfile(
+            name=segment.get('name') or '',
+            start=start,
+            end=start + count,
+            effect_name=segment.get('effect'),
+            color=hex_to_rgb(segment.get('color')),
+            delay=bounded(delay, DEFAULT_DELAY, 0, MAX_DELAY),
+        ))
+    return tuple(segments)
+
+
+def build_renderer_config(settings):
+    """The ('config', ...) payload for the renderer. Invalid values are
+    replaced, since the renderer cannot run with them."""
+    target_fps = settings.get_int(['target_fps'])
+    if target_fps is None or target_fps <= 0:
+        target_fps = DEFAULT_FPS
+    led_gamma = settings.get_float(['led_gamma'])
+    if led_gamma is None or led_gamma <= 0:
+        led_gamma = 1.0
+    return {
+        'target_fps': min(target_fps, MAX_FPS),
+        'led_gamma': bounded(led_gamma, 1.0, MIN_GAMMA, MAX_GAMMA),
+        # 0 turns the crossfade off
+        'transition_time': bounded(settings.get_int(['transition_time']), DEFAULT_TRANSITION, 0, MAX_TRANSITION),
+    }
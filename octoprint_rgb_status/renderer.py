@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from six.moves import range
+from six.moves.queue import Empty
+from .basic_effects import external_frame, load_numpy_builders
+from .frames import new_frame, frame_span
+from .metrics import RenderMetrics
+from .supervisor import HEARTBEAT_INTERVAL
+from .output import open_output, rgb_bytes
+from .utils import GammaCorrection, blend_frames
+from .timing import FrameClock, monotonic
+
+# Frame rate of transitions when the frame rate is not capped
+TRANSITION_FPS = 50
+
+
+def write_frame(output, pixels, start=0):
+    """Push pixels to the output, starting at pixel start, and show them."""
+    output.write(pixels, start)
+    output.show()
+
+
+class Layer(object):
+    """One effect playing on num_pixels pixels, with its own frame clock.
+
+    item holds the latest frame the effect produced, as a (frame, start,
+    end) span covering every pixel that changed since the layer was last
+    shown.
+    Steps the clock skips are not built for seekable effects, the
+    generator is started again at the step that is due instead.
+    """
+
+    def __init__(self, effect, num_pixels, target_fps):
+        self.effect = effect
+        self.num_pixels = num_pixels
+        self.target_fps = target_fps
+        self.item = None
+        self.unshown = None
+        self.restart()
+
+    def restart(self):
+        self.frames = None
+        self.position = 0
+        self.idle = False
+        self.clock = FrameClock(self.effect['delay'] / 1000.0, self.target_fps)
+
+    def new_frames(self, step=0):
+        effect = self.effect
+        kwargs = dict(effect['kwargs'], step=step) if step else effect['kwargs']
+        return effect['effect'](
+            self.num_pixels, effect['color'], effect['delay'],
+            reverse=effect['reverse'], **kwargs)
+
+    def next_frame(self):
+        if self.frames is None:
+            self.frames = self.new_frames()
+            self.position = 0
+        item = next(self.frames, None)
+        if item is None:
+            # Effects loop until they are replaced
+            self.frames = self.new_frames()
+            self.position = 0
+            item = next(self.frames, None)
+        self.position += 1
+        return item
+
+    def skip(self, steps):
+        """Move steps steps on without showing them."""
+        if steps <= 0:
+            return
+        if getattr(self.effect['effect'], 'seekable', False):
+            if self.frames is None:
+                self.position = 0
+            self.position += steps
+            self.frames = self.new_frames(self.position)
+        else:
+            for i in range(steps):
+                self.next_frame()
+
+    def next_tick(self):
+        return None if self.idle else self.clock.next_tick()
+
+    def due(self, now):
+        return not self.idle and now >= self.clock.next_tick()
+
+    def advance(self, now):
+        steps = self.clock.advance(now)
+        self.skip(steps - 1)
+        item = self.next_frame()
+        self.idle = getattr(self.effect['effect'], 'static', False)
+        if item is not None:
+            self.set_item(item)
+        return steps
+
+    def update_progress(self, progress):
+        self.effect['kwargs']['progress'] = progress
+        if self.frames is not None and getattr(self.effect['effect'], 'incremental', False):
+            self.set_item(self.frames.send(progress))
+        else:
+            self.restart()
+
+    def set_item(self, item):
+        """Take an item from the effect. Spans that were not shown yet are
+        merged into it, so none of their pixels are left out."""
+        frame, start, end = frame_span(item)
+        if self.unshown is not None:
+            start, end = min(start, self.unshown[0]), max(end, self.unshown[1])
+        self.unshown = (start, end)
+        self.item = (frame, start, end)
+
+    def mark_shown(self):
+        self.unshown = None
+
+
+class Renderer(object):
+    """Plays the requested effects on the strips, one frame per deadline.
+
+    All configured strips are driven as one strip, numbered in the order
+    they are configured, and shown together once per frame.
+
+    The status effect covers the whole strip. Segments are fixed pixel
+    ranges running their own effects, drawn over the status effect. Every
+    effect is a Layer whose steps last 'delay' milliseconds and are
+    scheduled against its own FrameClock, which skips steps when the
+    renderer falls behind. Whenever any layer has moved on, the layers are
+    composited into one frame and shown, at most target_fps times per
+    second. Between frames the renderer blocks on the control queue until
+    the next deadline, so a new message interrupts the wait immediately.
+
+    A status effect started with blackout covers the segments too, until
+    the next status effect starts and the segments start over. That is how
+    the lights are turned off.
+
+    A new status effect fades in over transition_time milliseconds,
+    starting from the frame that was on the strip when it was requested.
+
+    Gamma correction is applied to the pixels on their way to the strip.
+    Frames identical to the one already on the strip are not written
+    again, and once every layer is static the renderer sleeps until the
+    next message. Status effects started with a min_time hold the strip for
+    that long; effect requests arriving in the meantime are queued and only
+    the latest one is started once the hold expires.
+
+    Render metrics are sent to status_queue as ('metrics', report) every
+    few seconds while anything is happening. For lease seconds after a
+    'preview' message, every changed frame is also sent as ('preview', rgb),
+    at most fps times per second and reduced to max_pixels pixels.
+
+    Messages on the queue are either 'KILL' or a (command, payload) tuple:
+        ('effect', {'name', 'effect', 'color', 'delay', 'reverse', 'min_time', 'force', 'kwargs'[, 'blackout']})
+        ('progress', progress)
+        ('segments', [{'start', 'end', 'effect', 'color', 'delay', 'reverse', 'kwargs'}])
+        ('output', output config, see open_output())
+        ('config', {'target_fps', 'led_gamma', 'transition_time'})
+        ('preview', {'lease', 'fps', 'max_pixels'})
+        ('frame', None) to show the latest frame in frame_buffer
+
+    The renderer sets heartbeat, a shared double, to the current monotonic
+    time at least every HEARTBEAT_INTERVAL seconds, so the plugin can tell
+    a renderer that hangs from one that is merely idle.
+    """
+
+    def __init__(self, queue, output_config, shutdown_event, status_queue=None, frame_buffer=None, heartbeat=None):
+        self.queue = queue
+        self.heartbeat = heartbeat
+        self.shutdown_event = shutdown_event
+        self.status_queue = status_queue
+        self.frame_buffer = frame_buffer
+        self.metrics = RenderMetrics()
+        self.output = open_output(output_config)
+        self.running = True
+        self.status = None
+        self.pending = None
+        self.hold_until = 0
+        self.segment_specs = []
+        self.segments = []
+        self.blackout = False
+        self.shown = None
+        self.dirty = False
+        self.next_show_at = 0
+        self.target_fps = 0
+        self.gamma = None
+        self.transition = 0
+        self.fade = None
+        self.fade_started = 0
+        self.preview = None
+        self.preview_due = False
+        self.next_preview_at = 0
+
+    def run(self):
+        try:
+            while self.running and not self.shutdown_event.is_set():
+                now = monotonic()
+                if self.heartbeat is not None:
+                    self.heartbeat.value = now
+                if self.pending is not None and now >= self.hold_until:
+                    self.start(self.pending)
+                layers = [] if getattr(self.output, 'discards_frames', False) else self.layers()
+                dropped = None
+                for layer in layers:
+                    if layer.due(now):
+                        dropped = (dropped or 0) + layer.advance(now) - 1
+                        self.dirty = True
+                if dropped is not None:
+                    self.metrics.rendered(monotonic() - now, dropped)
+                if self.dirty and now >= self.next_show_at:
+                    self.show()
+                if self.fade is not None:
+                    # Keep showing frames until the transition is over
+                    self.dirty = True
+                deadlines = [layer.next_tick() for layer in layers if not layer.idle]
+                if self.dirty:
+                    deadlines.append(self.next_show_at)
+                if self.pending is not None:
+                    deadlines.append(self.hold_until)
+                report_at = self.metrics.next_report()
+                if report_at is not None and self.status_queue is not None:
+                    if monotonic() >= report_at:
+                        self.status_queue.put(('metrics', self.metrics.report()))
+                    else:
+                        deadlines.append(report_at)
+                if self.preview is not None and self.preview_due:
+                    if monotonic() >= self.preview['until']:
+                        self.preview = None
+                    elif monotonic() >= self.next_preview_at:
+                        self.send_preview()
+                    else:
+                        deadlines.append(self.next_preview_at)
+                if self.heartbeat is not None:
+                    deadlines.append(now + HEARTBEAT_INTERVAL)
+                self.receive(max(min(deadlines) - monotonic(), 0) if deadlines else None)
+            if self.status is not None and (self.dirty or self.status.item is None):
+                # Show the last requested effect (usually "off") before exiting
+                self.fade = None
+                if self.status.item is None:
+                    self.status.advance(monotonic())
+                self.show()
+        finally:
+            self.close()
+
+    def visible_segments(self):
+        return [] if self.blackout else self.segments
+
+    def layers(self):
+        layers = [layer for start, end, layer in self.visible_segments()]
+        if self.status is not None:
+            layers.insert(0, self.status)
+        return layers
+
+    def num_pixels(self):
+        return self.output.num_pixels
+
+    def show(self):
+        """Composite the layers into one frame and push it to the strip."""
+        self.draw()
+        for layer in self.layers():
+            layer.mark_shown()
+
+    def draw(self):
+        self.dirty = False
+        now = monotonic()
+        if self.fade is not None and now >= self.fade_started + self.transition:
+            self.fade = None
+            # The strip still shows the blend, so write every pixel again
+            self.shown = None
+        if self.target_fps > 0:
+            self.next_show_at = now + 1.0 / self.target_fps
+        else:
+            self.next_show_at = now + (1.0 / TRANSITION_FPS if self.fade is not None else 0)
+        segments = self.visible_segments()
+        if not segments and self.fade is None:
+            if self.status is not None and self.status.item is not None:
+                self.write(self.status.item)
+            return
+        if self.status is not None and self.status.item is not None:
+            frame = frame_span(self.status.item)[0][:]
+        else:
+            frame = new_frame(self.num_pixels())
+        for start, end, layer in segments:
+            if layer.item is not None:
+                frame[start:end] = frame_span(layer.item)[0]
+        if self.fade is not None:
+            frame = blend_frames(self.fade, frame, (now - self.fade_started) / self.transition)
+        self.write(frame)
+
+    def write(self, item):
+        frame, start, end = frame_span(item)
+        if self.shown is None or len(self.shown) != len(frame):
+            self.shown = None
+            start, end = 0, len(frame)
+        elif start == 0 and end == len(frame):
+            if frame == self.shown:
+                return
+        elif frame[start:end] == self.shown[start:end]:
+            return
+        pixels = frame[start:end]
+        if self.gamma is not None:
+            pixels = self.gamma.correct(pixels)
+        started = monotonic()
+        write_frame(self.output, pixels, start)
+        self.metrics.shown(monotonic() - started)
+        if self.shown is None:
+            self.shown = frame[:]
+        else:
+            self.shown[start:end] = frame[start:end]
+        self.preview_due = self.preview is not None
+
+    def send_preview(self):
+        self.preview_due = False
+        self.next_preview_at = monotonic() + 1.0 / self.preview['fps']
+        frame = self.shown
+        if frame is None or self.status_queue is None:
+            return
+        count, max_pixels = len(frame), self.preview['max_pixels']
+        if count > max_pixels:
+            frame = [frame[i * count // max_pixels] for i in range(max_pixels)]
+        self.status_queue.put(('preview', bytes(rgb_bytes(frame))))
+
+    def start(self, effect):
+        if self.transition > 0 and self.shown is not None and len(self.shown) == self.num_pixels():
+            self.fade = self.shown[:]
+            self.fade_started = monotonic()
+        self.status = Layer(effect, self.num_pixels(), self.target_fps)
+        blackout, self.blackout = self.blackout, effect.get('blackout', False)
+        if blackout and not self.blackout:
+            # The segments did not run during the blackout, start them over
+            # rather than catching up on every step they missed
+            self.build_segments()
+        self.metrics.start_effect(effect.get('name') or effect['effect'].__name__)
+        self.pending = None
+        self.hold_until = self.status.clock.started + effect['min_time']
+
+    def build_segments(self):
+        num_pixels = self.num_pixels()
+        self.segments = []
+        for spec in self.segment_specs:
+            start, end = max(spec['start'], 0), min(spec['end'], num_pixels)
+            if start < end:
+                self.segments.append((start, end, Layer(spec, end - start, self.target_fps)))
+
+    def rebuild(self):
+        """Restart every layer, after the strip or the frame rate changed."""
+        if self.status is not None:
+            self.status = Layer(self.status.effect, self.num_pixels(), self.target_fps)
+        self.build_segments()
+        self.shown = None
+        self.fade = None
+
+    def receive(self, timeout):
+        """Wait up to timeout seconds (forever if None) for a message, then
+        handle it and everything else already waiting in the queue."""
+        try:
+            if timeout is None or timeout > 0:
+                message = self.queue.get(timeout=timeout)
+            else:
+                message = self.queue.get_nowait()
+        except Empty:
+            return
+        try:
+            self.metrics.received(self.queue.qsize() + 1)
+        except NotImplementedError:
+            # qsize() is not available on macOS
+            pass
+        while True:
+            self.handle(message)
+            if not self.running:
+                return
+            try:
+                message = self.queue.get_nowait()
+            except Empty:
+                return
+
+    def handle(self, message):
+        if message == 'KILL':
+            self.running = False
+            return
+        command, payload = message
+        if command == 'effect':
+            if payload['force'] or monotonic() >= self.hold_until:
+                self.start(payload)
+            else:
+                self.pending = payload
+        elif command == 'progress':
+            if self.pending is not None:
+                if 'progress' in self.pending['kwargs']:
+                    self.pending['kwargs']['progress'] = payload
+            elif self.status is not None and 'progress' in self.status.effect['kwargs']:
+                self.status.update_progress(payload)
+                self.dirty = True
+        elif command == 'segments':
+            self.segment_specs = payload
+            self.build_segments()
+            self.shown = None
+            self.dirty = True
+        elif command == 'output':
+            self.output.close()
+            self.output = open_output(payload)
+            self.rebuild()
+        elif command == 'config':
+            self.target_fps = payload['target_fps']
+            gamma = payload['led_gamma']
+            self.gamma = GammaCorrection(gamma) if gamma and gamma > 0 and gamma != 1 else None
+            self.transition = payload['transition_time'] / 1000.0
+            self.rebuild()
+        elif command == 'frame':
+            self.show_external_frame()
+        elif command == 'preview':
+            if payload['lease'] > 0:
+                self.preview = dict(payload, until=monotonic() + payload['lease'])
+                self.preview_due = True
+            else:
+                self.preview = None
+
+    def show_external_frame(self):
+        """Replace the status effect with the latest frame in the frame
+        buffer. Following frames only replace the frame."""
+        if self.frame_buffer is None:
+            return
+        frame = self.frame_buffer.read(self.num_pixels())
+        if frame is None:
+            return
+        if self.status is not None and self.status.effect['effect'] is external_frame and self.pending is None:
+            self.status.effect['kwargs']['frame'] = frame
+            self.status.set_item(frame)
+            self.dirty = True
+        else:
+            self.start({
+                'name': 'External',
+                'effect': external_frame,
+                'color': None,
+                'delay': 0,
+                'reverse': False,
+                'min_time': 0,
+                'force': True,
+                'kwargs': {'frame': frame},
+            })
+
+    def close(self):
+        self.output.close()
+        if self.frame_buffer is not None:
+            self.frame_buffer.close()
+        if self.status_queue is not None:
+            # Nobody might be reading the reports any more
+            self.status_queue.cancel_join_thread()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.close()
+        self.queue.join_thread()
+
+
+def run_renderer(queue, output_config, shutdown_event, status_queue=None, frame_buffer=None, heartbeat=None):
+    """Keep the output open for the lifetime of the plugin and play whichever
+    effect was requested last."""
+    if heartbeat is not None:
+        heartbeat.value = monotonic()
+    load_numpy_builders()
+    if heartbeat is not None:
+        heartbeat.value = monotonic()
+    try:
+        renderer = Renderer(queue, output_config, shutdown_event, status_queue, frame_buffer, heartbeat)
+    except Exception as e:
+        if status_queue is not None:
+            status_queue.put(('error', 'Could not open the output: {}'.format(e)))
+        raise
+    renderer.run()
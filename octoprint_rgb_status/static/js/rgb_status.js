@@ -16,46 +16,31 @@ $(function() {
             if (data.errors && data.errors.length > 0) {
                 add_errors(data.errors);
             }
-            if (data.spi_enabled) {
-                $('#enableSPIStep').addClass('complete');
-            } else {
-                $('#enableSPIStep button').unbind('click').bind('click', function() {
-                    var password = $('#enableSPIStep [name="password"]').val();
-                    OctoPrint.simpleApiCommand('rgb_status', 'enable_spi', {
-                        'password': password
-                    }).done(process_steps);
-                });
-            }
-            if (data.adduser_done) {
-                $('#addUserStep').addClass('complete');
-            } else {
-                $('#addUserStep button').unbind('click').bind('click', function() {
-                    var password = $('#addUserStep [name="password"]').val();
-                    OctoPrint.simpleApiCommand('rgb_status', 'adduser', {
-                        'password': password
-                    }).done(process_steps);
-                });
-            }
-            if (data.buffer_increased) {
-                $('#increaseBufferStep').addClass('complete');
-            } else {
-                $('#increaseBufferStep button').unbind('click').bind('click', function() {
-                    var password = $('#increaseBufferStep [name="password"]').val();
-                    OctoPrint.simpleApiCommand('rgb_status', 'increase_buffer', {
-                        'password': password
-                    }).done(process_steps);
-                });
+            update_step('#enableSPIStep', 'enable_spi', data.spi_enabled);
+            update_step('#addUserStep', 'adduser', data.adduser_done);
+            update_step('#increaseBufferStep', 'increase_buffer', data.buffer_increased);
+            update_step('#setFrequencyStep', 'set_frequency', data.frequency_set);
+        }
+
+        function update_step(step, command, complete) {
+            var button = $(step + ' button');
+            if (complete) {
+                $(step).addClass('complete');
+                return;
             }
-            if (data.frequency_set) {
-                $('#setFrequencyStep').addClass('complete');
-            } else {
-                $('#setFrequencyStep button').unbind('click').bind('click', function() {
-                    var password = $('#setFrequencyStep [name="password"]').val();
-                    OctoPrint.simpleApiCommand('rgb_status', 'set_frequency', {
-                        'password': password
-                    }).done(process_steps);
+            button.unbind('click').bind('click', function() {
+                var password = $(step + ' [name="password"]').val();
+                OctoPrint.simpleApiCommand('rgb_status', command, {
+                    'password': password
+                }).done(function(response) {
+                    if (response.job === undefined) {
+                        process_steps(response);
+                    } else {
+                        // The result arrives as a plugin message
+                        button.prop('disabled', true);
+                    }
                 });
-            }
+            });
         }
         var self = this;
         self.name = 'RGBStatusViewModel';
@@ -72,6 +57,15 @@ $(function() {
             }
         }
         self.onBeforeWizardFinish = self.onBeforeWizardTabChange
+        self.onDataUpdaterPluginMessage = function(plugin, data) {
+            if (plugin != 'rgb_status' || data.type != 'job' || !data.details) {
+                return;
+            }
+            container.find('ol li button').prop('disabled', false);
+            process_steps($.extend({}, data.details, {
+                'errors': data.job.error ? [data.job.error] : []
+            }));
+        }
         self.onWizardFinish = function() {
             var password = $('#setFrequencyStep [name="password"]').val();
             OctoPrint.simpleApiCommand('rgb_status', 'reboot', { 'password': password });
@@ -86,24 +80,75 @@ $(function() {
     function RGBStatusNavbarViewModel(parameters) {
         var self = this;
         self.url = OctoPrint.getSimpleApiUrl('rgb_status');
-        self.lightsOn = 'on';
+        self.lightsOn = ko.observable('on');
+        self.effect = ko.observable('');
         self.onOrOff = function(response) {
-            self.lightsOn = response.lightsOn ? 'on' : 'off';
+            self.lightsOn(response.lightsOn ? 'on' : 'off');
+            if (response.effect !== undefined) {
+                self.effect(response.effect || '');
+            }
         }
         self.flipSwitch = function() {
-            OctoPrint.postJson(self.url, { "command": "flipswitch" }).done(function(response) {
-                self.onOrOff(response);
-                var element = $('#navbar_plugin_rgb_status a');
-                element.removeClass();
-                element.addClass(self.lightsOn);
-            });
+            OctoPrint.postJson(self.url, { "command": "flipswitch" }).done(self.onOrOff);
         }
         self.onBeforeBinding = function() {
             OctoPrint.get(self.url).done(self.onOrOff);
         }
+        self.onDataUpdaterPluginMessage = function(plugin, data) {
+            // Sent whenever the effect or the switch changes, from any tab
+            if (plugin == 'rgb_status' && data.type == 'lights') {
+                self.onOrOff(data);
+            }
+        }
     }
     OCTOPRINT_VIEWMODELS.push({
         construct: RGBStatusNavbarViewModel,
         elements: ['#navbar_plugin_rgb_status']
     });
+
+    function RGBStatusPreviewViewModel(parameters) {
+        // Streams the rendered frames while the settings are open. The
+        // stream runs on a lease which is renewed until they are closed.
+        var self = this;
+        self.renewal = null;
+        self.subscribe = function(active) {
+            OctoPrint.simpleApiCommand('rgb_status', 'preview', { 'active': active }).done(function(response) {
+                if (active && self.renewal === null) {
+                    self.renewal = setInterval(function() {
+                        self.subscribe(true);
+                    }, response.lease * 1000 / 2);
+                }
+            });
+        }
+        self.onSettingsShown = function() {
+            self.subscribe(true);
+        }
+        self.onSettingsHidden = function() {
+            clearInterval(self.renewal);
+            self.renewal = null;
+            self.subscribe(false);
+        }
+        self.onDataUpdaterPluginMessage = function(plugin, data) {
+            if (plugin != 'rgb_status' || data.type != 'preview') {
+                return;
+            }
+            var canvas = document.getElementById('rgbStatusPreview');
+            if (!canvas) {
+                return;
+            }
+            var pixels = atob(data.pixels);
+            var count = pixels.length / 3;
+            var context = canvas.getContext('2d');
+            var width = canvas.width / count;
+            context.clearRect(0, 0, canvas.width, canvas.height);
+            for (var i = 0; i < count; i++) {
+                context.fillStyle = 'rgb(' + pixels.charCodeAt(i * 3) + ',' + pixels.charCodeAt(i * 3 + 1) + ',' + pixels.charCodeAt(i * 3 + 2) + ')';
+                context.fillRect(i * width, 0, Math.max(width - 1, 1), canvas.height);
+            }
+        }
+    }
+    OCTOPRINT_VIEWMODELS.push({
+        construct: RGBStatusPreviewViewModel,
+        elements: []
+    });
 });
\ No newline at end of file
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from .timing import monotonic
+
+# The renderer touches its heartbeat at least every HEARTBEAT_INTERVAL
+# seconds and counts as hung once it has not for HEARTBEAT_TIMEOUT seconds.
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 15.0
+# Until its first heartbeat, a renderer that is still importing and opening
+# its output gets this long instead.
+STARTUP_TIMEOUT = 120.0
+# Seconds between two looks at the renderer
+CHECK_INTERVAL = 1.0
+MIN_DELAY = 1.0
+MAX_DELAY = 300.0
+# A renderer that kept running this long starts the backoff over
+STABLE_AFTER = 60.0
+
+
+class RestartBackoff(object):
+    """Decides when a renderer that failed may be started again. Every
+    failure in a row doubles the wait, from min_delay up to max_delay, so a
+    strip that cannot be opened at all is not retried in a tight loop."""
+
+    def __init__(self, min_delay=MIN_DELAY, max_delay=MAX_DELAY, stable_after=STABLE_AFTER):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.failures = 0
+        self.started = None
+        self.restart_at = None
+
+    def started_renderer(self, now=None):
+        self.started = monotonic() if now is None else now
+        self.restart_at = None
+
+    def failed(self, now=None):
+        """Count a failure and return the seconds until the next start."""
+        now = monotonic() if now is None else now
+        if self.started is not None and now - self.started >= self.stable_after:
+            self.failures = 0
+        delay = min(self.min_delay * 2 ** self.failures, self.max_delay)
+        self.failures += 1
+        self.restart_at = now + delay
+        return delay
+
+    def pending(self):
+        return self.restart_at is not None
+
+    def due(self, now=None):
+        now = monotonic() if now is None else now
+        return self.restart_at is not None and now >= self.restart_at
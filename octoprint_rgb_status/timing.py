@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+
+class FrameClock(object):
+    """Maps a monotonic clock onto the steps of an animation.
+
+    Step n of an animation is due period * n seconds after the clock was
+    started, no matter how long rendering the previous steps took, so the
+    animation speed does not depend on the strip length. Frames are shown
+    at most max_fps times per second; steps that fall due between two
+    frames, or while the renderer was busy, are skipped rather than
+    slowing the animation down.
+    """
+
+    def __init__(self, period, max_fps=0, now=None):
+        self.period = max(period, 0)
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0
+        self.started = monotonic() if now is None else now
+        self.step = -1
+        self.last_tick = None
+
+    def next_tick(self):
+        """When the next frame should be shown."""
+        if self.last_tick is None:
+            return self.started
+        due = self.started + (self.step + 1) * self.period
+        return max(due, self.last_tick + self.min_interval)
+
+    def advance(self, now):
+        """Move the clock to now and return how many steps it moved, at
+        least one. Every step but the last one is a dropped frame."""
+        if self.period > 0:
+            step = max(int((now - self.started) / self.period), self.step + 1)
+        else:
+            step = self.step + 1
+        steps = step - self.step
+        self.step = step
+        self.last_tick = now
+        return steps
@@ -1,18 +1,96 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 from math import sqrt
+from six.moves import range
+
+SQUARES = [value * value for value in range(256)]
+_sqrt_table = None
+_gamma_tables = {}
 
 
 def blend(a, b, t):
     return sqrt((1-t)*pow(a, 2) + t * pow(b, 2))
 
 
+def sqrt_table():
+    """Integer square roots of 0..255**2, built on first use."""
+    global _sqrt_table
+    if _sqrt_table is None:
+        table = bytearray(SQUARES[-1] + 1)
+        for root in range(256):
+            end = SQUARES[root + 1] if root < 255 else len(table)
+            table[SQUARES[root]:end] = bytearray([root]) * (end - SQUARES[root])
+        _sqrt_table = table
+    return _sqrt_table
+
+
 def blend_colors(color1, color2, percentage):
+    """Blend two RGB tuples the same way blend() does, in integer math with
+    the percentage rounded down to 1/65536 steps."""
+    roots = sqrt_table()
+    weight = min(max(int(percentage * 65536), 0), 65536)
+    inverse = 65536 - weight
     return (
-       int(blend(color1[0], color2[0], percentage)),
-       int(blend(color1[1], color2[1], percentage)),
-       int(blend(color1[2], color2[2], percentage))
-   )
+        roots[(inverse * SQUARES[color1[0]] + weight * SQUARES[color2[0]]) >> 16],
+        roots[(inverse * SQUARES[color1[1]] + weight * SQUARES[color2[1]]) >> 16],
+        roots[(inverse * SQUARES[color1[2]] + weight * SQUARES[color2[2]]) >> 16],
+    )
+
+
+def blend_frames(frame1, frame2, percentage):
+    """Blend two frames of packed colors pixel by pixel, every channel the
+    way blend_colors() does. Returns a new frame of the type of frame2."""
+    roots = sqrt_table()
+    weight = min(max(int(percentage * 65536), 0), 65536)
+    inverse = 65536 - weight
+    frame = frame2[:]
+    for i, (color1, color2) in enumerate(zip(frame1, frame2)):
+        if color1 != color2:
+            frame[i] = (
+                (roots[(inverse * SQUARES[(color1 >> 24) & 255] + weight * SQUARES[(color2 >> 24) & 255]) >> 16] << 24) |
+                (roots[(inverse * SQUARES[(color1 >> 16) & 255] + weight * SQUARES[(color2 >> 16) & 255]) >> 16] << 16) |
+                (roots[(inverse * SQUARES[(color1 >> 8) & 255] + weight * SQUARES[(color2 >> 8) & 255]) >> 16] << 8) |
+                roots[(inverse * SQUARES[color1 & 255] + weight * SQUARES[color2 & 255]) >> 16]
+            )
+    return frame
+
+
+def gamma_table(gamma):
+    """256 entry lookup table mapping a channel value through the gamma curve."""
+    table = _gamma_tables.get(gamma)
+    if table is None:
+        table = bytearray(int(round(pow(value / 255.0, gamma) * 255)) for value in range(256))
+        _gamma_tables[gamma] = table
+    return table
+
+
+class GammaCorrection(object):
+    """Applies a gamma curve to packed frame colors, remembering every color
+    it has corrected so far since effects reuse a handful of colors."""
+
+    MAX_COLORS = 4096
+
+    def __init__(self, gamma):
+        self.table = gamma_table(gamma)
+        self.colors = {}
+
+    def correct_color(self, color):
+        if len(self.colors) >= self.MAX_COLORS:
+            self.colors.clear()
+        table = self.table
+        corrected = (
+            (table[(color >> 24) & 255] << 24) |
+            (table[(color >> 16) & 255] << 16) |
+            (table[(color >> 8) & 255] << 8) |
+            table[color & 255]
+        )
+        self.colors[color] = corrected
+        return corrected
+
+    def correct(self, pixels):
+        colors = self.colors
+        correct_color = self.correct_color
+        return [colors[color] if color in colors else correct_color(color) for color in pixels]
 
 
 def hex_to_rgb(h):
@@ -21,3 +99,6 @@ def hex_to_rgb(h):
     h = h[1:7]
     return tuple(int(h[i:i+2], 16) for i in (0, 2 ,4))
 
+
+def rgb_to_hex(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(*rgb[:3])
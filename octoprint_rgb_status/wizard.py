@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import grp
+import io
+import os
+
+GROUP_FILE = '/etc/group'
+
+
+def parse_config(path):
+    """The settings in a config.txt, without comments."""
+    with io.open(path, encoding='utf-8', errors='replace') as file:
+        lines = [line.strip() for line in file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def parse_cmdline(path):
+    """The options on the kernel command line in a cmdline.txt."""
+    with io.open(path, encoding='utf-8', errors='replace') as file:
+        return file.read().split()
+
+
+def parse_groups(path):
+    """Group name: members. Read through grp so NSS groups count too."""
+    return dict((group.gr_name, list(group.gr_mem)) for group in grp.getgrall())
+
+
+class CachedFile(object):
+    """The parsed contents of a file, parsed again only once its mtime or
+    size changes or the cache is invalidated. A missing file parses to
+    missing."""
+
+    def __init__(self, path, parse, missing):
+        self.path = path
+        self.parse = parse
+        self.missing = missing
+        self.key = None
+        self.value = None
+
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime, stat.st_size)
+        except OSError:
+            key = False
+        if key != self.key or self.value is None:
+            self.value = self.parse(self.path) if key else self.missing
+            self.key = key
+        return self.value
+
+    def invalidate(self):
+        self.value = None
+
+
+class WizardChecks(object):
+    """The setup steps of the wizard, checked against the Pi's boot files."""
+
+    def __init__(self, boot_path='/boot', user='pi'):
+        self.boot_path = boot_path
+        self.user = user
+        self.config_path = os.path.join(boot_path, 'config.txt')
+        self.cmdline_path = os.path.join(boot_path, 'cmdline.txt')
+        self.config = CachedFile(self.config_path, parse_config, [])
+        self.cmdline = CachedFile(self.cmdline_path, parse_cmdline, [])
+        self.groups = CachedFile(GROUP_FILE, parse_groups, {})
+
+    def adduser_done(self):
+        return self.user in self.groups.get().get('gpio', [])
+
+    def spi_enabled(self):
+        return any(line.startswith('dtparam=spi=on') for line in self.config.get())
+
+    def buffer_increased(self):
+        return any(option.startswith('spidev.bufsiz=') for option in self.cmdline.get())
+
+    def frequency_set(self):
+        return any(line.startswith('core_freq=250') for line in self.config.get())
+
+    def details(self):
+        return {
+            'adduser_done': self.adduser_done(),
+            'spi_enabled': self.spi_enabled(),
+            'buffer_increased': self.buffer_increased(),
+            'frequency_set': self.frequency_set(),
+        }
+
+    def invalidate(self):
+        for cached in (self.config, self.cmdline, self.groups):
+            cached.invalidate()